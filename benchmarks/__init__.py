@@ -0,0 +1,8 @@
+"""
+Benchmarks for sphinx-gitref
+
+Generates a synthetic project, times the parser, hashing, checking, updating and full
+builds against it, and compares the results with a stored baseline. Run with::
+
+    python -m benchmarks --help
+"""
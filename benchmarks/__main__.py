@@ -0,0 +1,97 @@
+"""
+Command line interface for the benchmarks
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import click
+
+from .corpus import Spec
+from .runner import DEFAULT_TOLERANCE, compare, run
+from .suites import BENCHMARKS
+
+
+DEFAULTS = Spec()
+
+
+@click.command()
+@click.option("--files", default=DEFAULTS.files, help="Number of Python files")
+@click.option(
+    "--functions",
+    default=DEFAULTS.functions,
+    help="Number of functions in each file and methods in each class",
+)
+@click.option(
+    "--depth", default=DEFAULTS.depth, help="Depth of packages and nested classes"
+)
+@click.option(
+    "--references", default=DEFAULTS.references, help="Number of gitref roles"
+)
+@click.option(
+    "--per-doc", default=DEFAULTS.per_doc, help="Number of gitref roles per document"
+)
+@click.option("--seed", default=DEFAULTS.seed, help="Seed used to pick references")
+@click.option("--repeat", default=5, help="Number of times to time each benchmark")
+@click.option(
+    "--only",
+    multiple=True,
+    type=click.Choice(list(BENCHMARKS)),
+    help="Benchmark to run; can be used more than once. Defaults to all",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="File to write the results to, instead of stdout",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Results to compare against; fails if any benchmark has regressed",
+)
+@click.option(
+    "--tolerance",
+    default=DEFAULT_TOLERANCE,
+    help="Fraction a benchmark can be slower than the baseline",
+)
+def main(
+    files,
+    functions,
+    depth,
+    references,
+    per_doc,
+    seed,
+    repeat,
+    only,
+    output,
+    baseline,
+    tolerance,
+):
+    """
+    Time sphinx-gitref against a synthetic project, and output the results as JSON
+    """
+    spec = Spec(files, functions, depth, references, per_doc, seed)
+    results = run(spec, only or None, repeat)
+
+    data = json.dumps(results, indent=2)
+    if output:
+        output.write_text(data + "\n")
+    else:
+        click.echo(data)
+
+    if baseline:
+        try:
+            regressions = compare(results, json.loads(baseline.read_text()), tolerance)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        for regression in regressions:
+            click.echo(regression, err=True)
+        if regressions:
+            num = len(regressions)
+            benchmarks = "benchmark" if num == 1 else "benchmarks"
+            raise click.ClickException(f"{num} {benchmarks} slower than the baseline")
+
+
+if __name__ == "__main__":
+    main()
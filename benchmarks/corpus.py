@@ -0,0 +1,173 @@
+"""
+Synthetic projects to benchmark against
+"""
+from __future__ import annotations
+
+import os
+import random
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+
+#: Git config for the generated project - only the remote is needed
+GIT_CONFIG = """[remote "origin"]
+        url = git@github.com:example/corpus.git
+"""
+
+CONF = """
+master_doc = "index"
+extensions = ["sphinx_gitref"]
+gitref_branch = "main"
+"""
+
+
+class Spec(NamedTuple):
+    """
+    Parameters of a synthetic project
+    """
+
+    #: Number of Python files
+    files: int = 20
+
+    #: Number of functions in each file, and methods in each of its classes, which sets
+    #: the size of the files
+    functions: int = 20
+
+    #: Depth of the package directories, and of the nested classes in each file
+    depth: int = 2
+
+    #: Number of gitref roles across all documents
+    references: int = 200
+
+    #: Number of references in each document
+    per_doc: int = 20
+
+    #: Seed used to pick the references
+    seed: int = 0
+
+
+class Corpus:
+    """
+    A synthetic project with Python code, and Sphinx docs which reference it
+    """
+
+    #: Parameters the project was generated with
+    spec: Spec
+
+    #: Project root, containing ``.git``
+    root: Path
+
+    #: Sphinx source dir, containing ``conf.py``
+    docs: Path
+
+    #: Python files, relative to the project root
+    filenames: list[str]
+
+    #: Targets of the roles, in the order they appear in the docs
+    targets: list[str]
+
+    def __init__(self, root: Path, spec: Spec):
+        self.root = root
+        self.spec = spec
+        self.docs = root / "docs"
+        self.filenames = []
+        self.targets = []
+
+    @property
+    def hash_file(self) -> Path:
+        return self.docs / "gitref.json"
+
+    def generate(self):
+        """
+        Write the project to disk
+        """
+        spec = self.spec
+        git = self.root / ".git"
+        git.mkdir(parents=True)
+        (git / "config").write_text(GIT_CONFIG)
+        (git / "HEAD").write_text("ref: refs/heads/main\n")
+
+        coderefs = self.get_coderefs()
+        for i in range(spec.files):
+            package = "/".join(f"pkg{level}" for level in range(spec.depth))
+            filename = f"{package}/module{i}.py" if package else f"module{i}.py"
+            path = self.root / filename
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(self.get_module(i))
+            self.filenames.append(filename)
+
+        rand = random.Random(spec.seed)
+        self.targets = []
+        for _ in range(spec.references):
+            filename = rand.choice(self.filenames)
+            coderef = rand.choice(coderefs)
+            self.targets.append(f"{filename}::{coderef}" if coderef else filename)
+
+        self.generate_docs()
+
+        # Backdate the files so they are trusted by their stat signatures
+        past = time.time_ns() - 10 * 10**9
+        for path in self.root.rglob("*"):
+            os.utime(path, ns=(past, past))
+
+    def get_coderefs(self) -> list[str | None]:
+        """
+        Return the code references found in every module, with None for the file
+        """
+        coderefs = [None, "VALUE"]
+        coderefs += [f"function{i}" for i in range(self.spec.functions)]
+        cls = ""
+        for level in range(self.spec.depth):
+            cls = f"{cls}.Class{level}" if cls else f"Class{level}"
+            coderefs.append(cls)
+            coderefs += [f"{cls}.method{i}" for i in range(self.spec.functions)]
+        return coderefs
+
+    def get_module(self, num: int) -> str:
+        lines = [f'"""\nModule {num}\n"""\n', f"VALUE = {num}\n"]
+        for i in range(self.spec.functions):
+            lines.append(get_function(f"function{i}", num, ""))
+
+        for level in range(self.spec.depth):
+            indent = "    " * level
+            lines.append(f"{indent}class Class{level}:\n")
+            lines.append(
+                f'{indent}    """\n{indent}    Class {level}\n{indent}    """\n'
+            )
+            for i in range(self.spec.functions):
+                lines.append(get_function(f"method{i}", num, indent + "    ", "self, "))
+        return "\n".join(lines)
+
+    def generate_docs(self):
+        self.docs.mkdir()
+        (self.docs / "conf.py").write_text(CONF)
+
+        per_doc = self.spec.per_doc
+        docs = [
+            self.targets[i : i + per_doc] for i in range(0, len(self.targets), per_doc)
+        ]
+        (self.docs / "index.rst").write_text(
+            "Index\n=====\n\n.. toctree::\n\n"
+            + "".join(f"   doc{i}\n" for i in range(len(docs)))
+        )
+        for i, targets in enumerate(docs):
+            (self.docs / f"doc{i}.rst").write_text(
+                f"Doc {i}\n{'=' * len(f'Doc {i}')}\n\n"
+                + "".join(f"* :gitref:`{target}`\n" for target in targets)
+            )
+
+
+def get_function(name: str, num: int, indent: str, args: str = "") -> str:
+    """
+    Return the source of a function with a few statements to parse and hash
+    """
+    return (
+        f"{indent}def {name}({args}value, *items, **options):\n"
+        f'{indent}    """\n{indent}    Return {name} of module {num}\n{indent}    """\n'
+        f"{indent}    total = value + {num}\n"
+        f"{indent}    for item in items:\n"
+        f"{indent}        if item in options:\n"
+        f"{indent}            total += options[item]\n"
+        f"{indent}    return [total, {{'name': {name!r}}}]\n"
+    )
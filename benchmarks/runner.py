@@ -0,0 +1,106 @@
+"""
+Run benchmarks and compare their results with a baseline
+
+Results are JSON-serialisable dicts::
+
+    {
+        "version": 1,
+        "python": "3.11.7",
+        "spec": {"files": 20, ...},
+        "benchmarks": {"check": {"min": 0.01, "median": 0.012, "repeat": 5}, ...}
+    }
+
+Timings are in seconds. Comparisons use the minimum, which is the least affected by
+other activity on the machine.
+"""
+from __future__ import annotations
+
+import platform
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterable
+
+from .corpus import Corpus, Spec
+from .suites import BENCHMARKS
+
+
+#: Current results format version
+RESULTS_VERSION = 1
+
+#: Fraction a benchmark can be slower than the baseline before it is a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+def time_func(func: Callable[[], None], repeat: int) -> dict:
+    """
+    Call a function ``repeat`` times, and return the timings
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "repeat": repeat,
+    }
+
+
+def run(spec: Spec, names: Iterable[str] | None = None, repeat: int = 5) -> dict:
+    """
+    Generate a corpus and run the benchmarks against it
+
+    Arguments:
+        spec: Parameters of the corpus
+        names: Names of the benchmarks to run, or None to run all
+        repeat: Number of times to time each benchmark
+    """
+    names = list(BENCHMARKS if names is None else names)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = Corpus(Path(tmp), spec)
+        corpus.generate()
+        for name in names:
+            func = BENCHMARKS[name](corpus)
+            results[name] = time_func(func, repeat)
+
+    return {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "spec": spec._asdict(),
+        "benchmarks": results,
+    }
+
+
+def compare(
+    results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE
+) -> list[str]:
+    """
+    Compare results with a baseline, and return a message for each regression
+
+    Benchmarks which aren't in both are ignored.
+
+    Raises:
+        ValueError: If the results were run against a different corpus
+    """
+    if results["spec"] != baseline["spec"]:
+        raise ValueError("Baseline was run against a different corpus")
+
+    regressions = []
+    for name, timing in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        expected = baseline["benchmarks"][name]["min"]
+        if timing["min"] > expected * (1 + tolerance):
+            regressions.append(
+                f"{name}: {timing['min']:.4f}s, baseline {expected:.4f}s"
+                f" ({timing['min'] / expected - 1:+.0%})"
+            )
+    return regressions
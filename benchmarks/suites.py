@@ -0,0 +1,169 @@
+"""
+Benchmarks to time against a corpus
+
+Each benchmark is a function which is given the corpus, performs any setup, and returns
+a function to time. The timed function is called repeatedly, so must leave the corpus
+as it found it.
+"""
+from __future__ import annotations
+
+import shutil
+from typing import Callable
+
+from sphinx_gitref.builders import create_app
+from sphinx_gitref.constants import CACHE_FILENAME
+from sphinx_gitref.hasher import Hasher, hash_file, hash_node
+from sphinx_gitref.parser import ParsedModule, parsed_module_to_node, python_to_node
+
+from .corpus import Corpus
+
+
+#: Registered benchmarks, by name
+BENCHMARKS: dict[str, Callable[[Corpus], Callable[[], None]]] = {}
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark
+    """
+
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+def clean(corpus: Corpus):
+    """
+    Remove the Sphinx environment and symbol cache, so a build starts from scratch
+    """
+    shutil.rmtree(corpus.docs / "_build", ignore_errors=True)
+    (corpus.docs / CACHE_FILENAME).unlink(missing_ok=True)
+
+
+def get_coderefs(corpus: Corpus) -> list[tuple[str, str]]:
+    """
+    Return the unique ``(filename, coderef)`` pairs referenced by the docs
+    """
+    return sorted(
+        {tuple(target.split("::", 1)) for target in corpus.targets if "::" in target}
+    )
+
+
+def make_hasher(corpus: Corpus, updating: bool, **kwargs) -> Hasher:
+    return Hasher(corpus.hash_file, corpus.root, True, updating, workers=1, **kwargs)
+
+
+def update(corpus: Corpus):
+    """
+    Write the hash file for the corpus
+    """
+    hasher = make_hasher(corpus, True)
+    hasher.find_targets(corpus.targets)
+    if hasher.errors:
+        raise ValueError(f"Corpus has invalid references: {hasher.errors}")
+    hasher.build_file()
+
+
+@benchmark("python_to_node")
+def bench_python_to_node(corpus: Corpus):
+    """
+    Parse each referenced file and find the coderef, without a module cache
+    """
+    coderefs = get_coderefs(corpus)
+
+    def run():
+        for filename, coderef in coderefs:
+            python_to_node(corpus.root / filename, coderef)
+
+    return run
+
+
+@benchmark("hash_node")
+def bench_hash_node(corpus: Corpus):
+    """
+    Hash the AST node of each referenced coderef
+    """
+    modules = {}
+    nodes = []
+    for filename, coderef in get_coderefs(corpus):
+        if filename not in modules:
+            modules[filename] = ParsedModule((corpus.root / filename).read_text())
+        nodes.append(parsed_module_to_node(modules[filename], coderef))
+
+    def run():
+        for node in nodes:
+            hash_node(node)
+
+    return run
+
+
+@benchmark("hash_file")
+def bench_hash_file(corpus: Corpus):
+    """
+    Hash every Python file
+    """
+    paths = [corpus.root / filename for filename in corpus.filenames]
+
+    def run():
+        for path in paths:
+            hash_file(path)
+
+    return run
+
+
+@benchmark("check")
+def bench_check(corpus: Corpus):
+    """
+    Load the hash file and check it, trusting unchanged files by their stat signature
+    """
+    update(corpus)
+    return lambda: make_hasher(corpus, False).check()
+
+
+@benchmark("check_paranoid")
+def bench_check_paranoid(corpus: Corpus):
+    """
+    Load the hash file and check every target against the code
+    """
+    update(corpus)
+    return lambda: make_hasher(corpus, False, paranoid=True).check()
+
+
+@benchmark("build_file")
+def bench_build_file(corpus: Corpus):
+    """
+    Write the hash file from resolved targets
+    """
+    hasher = make_hasher(corpus, True)
+    hasher.find_targets(corpus.targets)
+    return hasher.build_file
+
+
+@benchmark("build")
+def bench_build(corpus: Corpus):
+    """
+    Check every document with a fresh Sphinx build using the null builder
+    """
+    update(corpus)
+
+    def run():
+        clean(corpus)
+        create_app(corpus.docs).build()
+
+    return run
+
+
+@benchmark("build_update")
+def bench_build_update(corpus: Corpus):
+    """
+    Update the hash file with a fresh Sphinx build using the null builder
+    """
+
+    def run():
+        clean(corpus)
+        corpus.hash_file.unlink(missing_ok=True)
+        create_app(corpus.docs, {"gitref_updating": True}).build()
+
+    return run
@@ -1,9 +1,105 @@
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import IO, NamedTuple
+
+from sphinx.application import Sphinx
 from sphinx.builders import Builder
 from sphinx.util import logging
 
 logger = logging.getLogger(__name__)
 
 
+#: Variable assignment in a Sphinx Makefile, eg ``SOURCEDIR = source``
+MAKEFILE_VAR = re.compile(
+    r"^(?P<name>SOURCEDIR|BUILDDIR)\s*[?:]?=\s*(?P<value>.*?)\s*$"
+)
+
+
+class SphinxDirs(NamedTuple):
+    """
+    Source and build dirs of a Sphinx project
+    """
+
+    #: Source dir, containing ``conf.py``
+    source: Path
+
+    #: Build dir, containing the ``doctrees`` dir
+    build: Path
+
+
+def read_makefile(path: Path) -> dict[str, str]:
+    """
+    Return the ``SOURCEDIR`` and ``BUILDDIR`` set in a Sphinx Makefile
+    """
+    values = {}
+    for line in path.read_text().splitlines():
+        matches = MAKEFILE_VAR.match(line)
+        if matches:
+            values[matches.group("name")] = matches.group("value")
+    return values
+
+
+def find_dirs(dir: Path) -> SphinxDirs:
+    """
+    Find the source and build dirs of the Sphinx project in ``dir``
+
+    The dirs are read from a ``Makefile`` in ``dir`` if there is one, so the same
+    environment is used as ``make``. Otherwise they follow ``sphinx-quickstart``:
+    ``source`` and ``build`` dirs if ``dir`` has a ``source/conf.py``, or ``dir``
+    itself with a ``_build`` dir.
+    """
+    values = {}
+    makefile = dir / "Makefile"
+    if makefile.is_file():
+        values = read_makefile(makefile)
+
+    if "SOURCEDIR" in values:
+        source = dir / values["SOURCEDIR"]
+    elif not (dir / "conf.py").exists() and (dir / "source" / "conf.py").exists():
+        source = dir / "source"
+    else:
+        source = dir
+
+    if "BUILDDIR" in values:
+        build = dir / values["BUILDDIR"]
+    elif source != dir:
+        build = dir / "build"
+    else:
+        build = dir / "_build"
+
+    return SphinxDirs(source.resolve(), build.resolve())
+
+
+def create_app(
+    confdir: Path,
+    confoverrides: dict | None = None,
+    parallel: int = 0,
+    status: IO | None = None,
+    warning: IO | None = None,
+    build_dir: Path | None = None,
+) -> Sphinx:
+    """
+    Create a Sphinx app to build the docs in ``confdir`` with the null builder
+
+    Output is written to the ``null`` and ``doctrees`` dirs in the ``build_dir``, as
+    ``make null`` does. Defaults to the ``_build`` dir in ``confdir``.
+    """
+    build = build_dir or confdir / "_build"
+    return Sphinx(
+        srcdir=str(confdir),
+        confdir=str(confdir),
+        outdir=str(build / "null"),
+        doctreedir=str(build / "doctrees"),
+        buildername="null",
+        status=status,
+        warning=warning,
+        confoverrides=confoverrides or {},
+        parallel=parallel,
+    )
+
+
 class NullBuilder(Builder):
     """
     Builder which doesn't write its output
@@ -17,8 +113,12 @@ class NullBuilder(Builder):
         self.output = {}
 
     def get_outdated_docs(self):
-        """Return an iterable of input files that are outdated."""
-        return "all documents"
+        """
+        Return an iterable of input files that are outdated.
+
+        Nothing is written, so only the documents which are read need processing.
+        """
+        return []
 
     def get_target_uri(self, docname, typ=None):
         """Return the target URI for a document."""
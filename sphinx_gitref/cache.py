@@ -0,0 +1,183 @@
+"""
+Persistent symbol cache
+
+Stores the line numbers and hashes of resolved code references between builds, so that
+unchanged files don't need to be parsed again.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from typing import TYPE_CHECKING, Callable
+
+from sphinx.util.logging import getLogger
+
+from .constants import DEFAULT_HASH_MODE
+
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+logger = getLogger("sphinx_gitref")
+
+
+#: Current cache file format version
+CACHE_VERSION = 1
+
+#: Files modified within this many nanoseconds of being cached could be modified again
+#: without their stat signature changing, so aren't trusted by their signature
+RACY_WINDOW = 2 * 10**9
+
+
+def digest_file(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def get_stat_signature(path: Path) -> list[int] | None:
+    """
+    Return ``[mtime_ns, size, inode]`` for a file, or None if it was modified too
+    recently for its signature to be trusted
+    """
+    stat = path.stat()
+    if time.time_ns() - stat.st_mtime_ns < RACY_WINDOW:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+
+class SymbolCache:
+    """
+    Cache of symbols found in referenced Python files, persisted next to the hash file
+
+    Each file entry is keyed by a digest of the file contents, and maps the dotted names
+    which have been referenced to ``[lineno, end_lineno, hash]``. The file's stat
+    signature is also stored, so an untouched file can be trusted without reading it.
+    This also makes it a cache of file digests for whole-file and directory targets.
+
+    The cache is discarded if it was built with a different hash mode.
+    """
+
+    #: Path to the cache file, or None if the cache is in-memory only
+    file: Path | None
+
+    #: Hash mode used for the cached hashes
+    hash_mode: str
+
+    #: Cache data - filename to entry dict with ``stat``, ``digest`` and ``symbols``
+    entries: dict[str, dict]
+
+    #: Filenames which have been validated against the filesystem during this build
+    validated: set[str]
+
+    #: Whether the cache needs to be written
+    changed: bool
+
+    #: Function to calculate the digest of a file
+    digest_file: Callable[[Path], str]
+
+    def __init__(
+        self,
+        file: Path | None,
+        hash_mode: str = DEFAULT_HASH_MODE,
+        digest_file: Callable[[Path], str] = digest_file,
+    ):
+        self.file = file
+        self.hash_mode = hash_mode
+        self.digest_file = digest_file
+        self.entries = {}
+        self.validated = set()
+        self.changed = False
+        self.load()
+
+    def load(self):
+        """
+        Load the cache file, discarding it if it's unreadable or incompatible
+        """
+        if self.file is None or not self.file.exists():
+            return
+
+        try:
+            data = json.loads(self.file.read_text())
+        except ValueError:
+            logger.info(f"gitref cache at {self.file} is invalid, ignoring")
+            return
+
+        if (
+            data.get("version") != CACHE_VERSION
+            or data.get("hash_mode") != self.hash_mode
+        ):
+            return
+        self.entries = data["files"]
+
+    def save(self):
+        """
+        Write the cache file, if anything has changed
+        """
+        if self.file is None or not self.changed:
+            return
+
+        self.file.write_text(
+            json.dumps(
+                {
+                    "version": CACHE_VERSION,
+                    "hash_mode": self.hash_mode,
+                    "files": self.entries,
+                }
+            )
+        )
+        self.changed = False
+
+    def validate(self, filename: str, path: Path) -> dict:
+        """
+        Return the entry for a file, discarding its symbols if the file has changed
+
+        The file is only read if its stat signature has changed since it was cached.
+        """
+        if filename in self.validated:
+            return self.entries[filename]
+
+        signature = get_stat_signature(path)
+        entry = self.entries.get(filename)
+        if entry is None or signature is None or entry["stat"] != signature:
+            digest = self.digest_file(path)
+            if entry is None or entry["digest"] != digest:
+                entry = {"digest": digest, "symbols": {}}
+            entry["stat"] = signature
+            self.entries[filename] = entry
+            self.changed = True
+
+        self.validated.add(filename)
+        return entry
+
+    def digest(self, filename: str, path: Path) -> str:
+        """
+        Return the digest of a file's contents
+        """
+        return self.validate(filename, path)["digest"]
+
+    def get_symbols(self, filename: str, path: Path) -> dict[str, list]:
+        """
+        Return the cached symbols for a file, discarding them if the file has changed
+        """
+        return self.validate(filename, path)["symbols"]
+
+    def get(self, filename: str, path: Path, coderef: str) -> list | None:
+        """
+        Return ``[lineno, end_lineno, hash]`` for a coderef, or None if not cached
+        """
+        return self.get_symbols(filename, path).get(coderef)
+
+    def set(
+        self,
+        filename: str,
+        path: Path,
+        coderef: str,
+        lineno: int,
+        end_lineno: int,
+        hash: str,
+    ):
+        """
+        Store the symbol for a coderef
+        """
+        self.get_symbols(filename, path)[coderef] = [lineno, end_lineno, hash]
+        self.changed = True
@@ -1,33 +1,108 @@
+from __future__ import annotations
+
 import os
 import sys
 from pathlib import Path
-from subprocess import PIPE, STDOUT, run
 
 import click
+from sphinx.errors import SphinxError
+from sphinx.util.console import color_terminal, nocolor
+
+from .builders import SphinxDirs, create_app, find_dirs
+from .scanner import Scanner, find_with_sphinx
+from .watcher import Watcher
 
 
-def get_sphinx_dir(ctx, param, dir: str) -> Path:
-    """Ensure sure target dir has a conf.py and Makefile"""
+def get_sphinx_dir(ctx, param, dir: str) -> SphinxDirs:
+    """Find the source and build dirs, and ensure the source dir has a conf.py"""
     path = Path(dir).absolute()
     if not path.exists():
         raise click.UsageError(f"No dir found at {path}")
-    if not (path / "Makefile").exists():
-        raise click.UsageError(f"No Makefile found at {path}")
-    return path
-
-
-def make(dir: Path, opts: str):
-    env = os.environ.copy()
-    env["SPHINXOPTS"] = opts
-    result = run(
-        ["make", "null"],
-        cwd=dir,
-        stdout=PIPE,
-        stderr=STDOUT,
-        env=env,
-    )
-    click.echo(result.stdout.decode())
-    if result.returncode != 0:
+    dirs = find_dirs(path)
+    if not (dirs.source / "conf.py").exists():
+        raise click.UsageError(f"No conf.py found at {dirs.source}")
+    return dirs
+
+
+def get_jobs(ctx, param, jobs: str | None) -> int | None:
+    """Convert the number of jobs to an int, allowing ``auto`` for the CPU count"""
+    if jobs is None:
+        return None
+    if jobs == "auto":
+        return os.cpu_count() or 1
+    try:
+        jobs = int(jobs)
+    except ValueError:
+        raise click.BadParameter("must be a number or 'auto'")
+    if jobs < 1:
+        raise click.BadParameter("must be at least 1")
+    return jobs
+
+
+sphinx_dir_argument = click.argument(
+    "dirs", metavar="DIR", default=".", required=False, callback=get_sphinx_dir
+)
+
+
+jobs_option = click.option(
+    "--jobs",
+    "-j",
+    callback=get_jobs,
+    help="Number of processes to build and check with, or 'auto' for the CPU count",
+)
+
+
+def build(dirs: SphinxDirs, confoverrides: dict, jobs: int | None):
+    """
+    Build the docs in-process with the null builder, streaming its output
+    """
+    if jobs is not None:
+        confoverrides["gitref_workers"] = jobs
+    if not color_terminal():
+        nocolor()
+
+    try:
+        app = create_app(
+            dirs.source,
+            confoverrides=confoverrides,
+            parallel=jobs or 0,
+            status=sys.stdout,
+            warning=sys.stderr,
+            build_dir=dirs.build,
+        )
+        app.build()
+    except (SphinxError, ValueError) as e:
+        click.echo(str(e), err=True)
+        raise click.ClickException("sphinx-gitref failed")
+
+
+def scan_check(dirs: SphinxDirs, overrides: dict, cross_validate: bool):
+    scanner = Scanner(dirs.source, overrides)
+    try:
+        errors = scanner.check()
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    for error in errors:
+        click.echo(error)
+
+    def references(n):
+        return "reference" if n == 1 else "references"
+
+    num = len(scanner.hasher.used)
+    click.echo(f"{num} gitref {references(num)} found")
+    if scanner.unused:
+        num = len(scanner.unused)
+        click.echo(f"gitref hash file is out of date, {num} unused {references(num)}")
+
+    if cross_validate:
+        differences = scanner.cross_validate(find_with_sphinx(dirs.source, dirs.build))
+        for difference in differences:
+            click.echo(difference)
+        if differences:
+            raise click.ClickException("Scanner and Sphinx found different references")
+
+    if errors:
         raise click.ClickException("sphinx-gitref failed")
 
 
@@ -38,17 +113,77 @@ def cli():
 
 
 @cli.command()
-@click.argument("dir", default=".", required=False, callback=get_sphinx_dir)
-def check(dir: Path):
+@sphinx_dir_argument
+@click.option(
+    "--paranoid",
+    is_flag=True,
+    help="Hash all referenced files, even if they appear untouched",
+)
+@click.option(
+    "--changed",
+    is_flag=True,
+    help="Only check targets in files changed since the last update",
+)
+@click.option(
+    "--scan",
+    is_flag=True,
+    help="Find references by scanning the sources, without building with Sphinx",
+)
+@click.option(
+    "--cross-validate",
+    is_flag=True,
+    help="Scan the sources, and compare the references found with a Sphinx build",
+)
+@jobs_option
+def check(
+    dirs: SphinxDirs,
+    paranoid: bool,
+    changed: bool,
+    scan: bool,
+    cross_validate: bool,
+    jobs: int | None,
+):
     """Check referenced code hasn't been modified"""
-    make(dir, "-E -a")
+    overrides = {"gitref_paranoid": paranoid, "gitref_changed_only": changed}
+    if scan or cross_validate:
+        if jobs is not None:
+            overrides["gitref_workers"] = jobs
+        scan_check(dirs, overrides, cross_validate)
+        return
+
+    build(dirs, overrides, jobs)
 
 
 @cli.command()
-@click.argument("dir", default=".", required=False, callback=get_sphinx_dir)
-def update(dir: Path):
+@sphinx_dir_argument
+@click.option(
+    "--prune",
+    is_flag=True,
+    help="Remove targets which are no longer referenced",
+)
+@jobs_option
+def update(dirs: SphinxDirs, prune: bool, jobs: int | None):
     """Update hashes for referenced code"""
-    make(dir, "-D gitref_updating=True")
+    build(dirs, {"gitref_updating": True, "gitref_prune": prune}, jobs)
+
+
+@cli.command()
+@sphinx_dir_argument
+@click.option(
+    "--interval",
+    default=0.25,
+    type=float,
+    help="Seconds between checks for changes",
+)
+def watch(dirs: SphinxDirs, interval: float):
+    """Check references whenever the docs or referenced code change"""
+    watcher = Watcher(Scanner(dirs.source), interval=interval, echo=click.echo)
+    try:
+        watcher.run()
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    except KeyboardInterrupt:
+        pass
 
 
 def invoke():
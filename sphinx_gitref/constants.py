@@ -12,3 +12,32 @@ DEFAULT_LABEL_FORMAT = "{coderef}"
 
 #: Hash filename
 HASH_FILENAME = "gitref.json"
+
+#: Symbol cache filename, stored next to the hash file
+CACHE_FILENAME = "gitref.cache.json"
+
+#: int: Number of parsed Python files to keep in memory during a build
+DEFAULT_MODULE_CACHE_SIZE = 128
+
+#: Ways to parse Python files:
+#   full    Parse the whole file
+#   lazy    Tokenize the file to find top-level blocks, and only parse those referenced
+PARSE_MODES = ("full", "lazy")
+
+#: Ways to hash code references:
+#   unparse     Hash the code regenerated from the AST, ignoring comments and formatting
+#   source      Hash the original source of the definition
+#   structural  Hash the AST as a Merkle tree, ignoring comments and formatting
+HASH_MODES = ("unparse", "source", "structural")
+
+#: Hash mode used when updating the hash file
+DEFAULT_HASH_MODE = "unparse"
+
+#: int: Size in bytes at which whole-file targets are streamed instead of read at once
+DEFAULT_STREAM_THRESHOLD = 1024 * 1024
+
+#: list: Patterns of file and directory names to skip when hashing a directory target
+DEFAULT_IGNORE_PATTERNS = ["__pycache__", "*.py[cod]", ".git", ".DS_Store"]
+
+#: int: Number of targets in the hash file before checks are run in parallel
+PARALLEL_CHECK_THRESHOLD = 500
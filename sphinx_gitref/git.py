@@ -6,24 +6,367 @@ current git repository. At some point we may want the reliability improvement an
 additional features available by moving to something like GitPython; that should be
 possible with a drop-in replacement, but for now this should suffice.
 """
+import os
 import re
+import struct
 from configparser import NoSectionError, RawConfigParser
 from io import StringIO
+from subprocess import DEVNULL, PIPE, CalledProcessError, run
+from typing import NamedTuple
 
 from .constants import DEFAULT_REMOTE
 
 
+class IndexEntry(NamedTuple):
+    """
+    The cached stat data and blob id for a file in the git index
+    """
+
+    mtime_s: int
+    mtime_ns: int
+    ino: int
+    size: int
+    blob: str
+    flags: int
+    extended_flags: int
+
+
+class Index:
+    """
+    Read-only view of a ``.git/index`` file
+
+    Supports index versions 2 to 4. Entries can be used to tell if a tracked file is
+    unchanged since it was last staged, without reading it.
+    """
+
+    HEADER = struct.Struct(">4sLL")
+    ENTRY = struct.Struct(">LLLLLLLLLL20sH")
+
+    #: Flag bits
+    FLAG_ASSUME_VALID = 0x8000
+    FLAG_EXTENDED = 0x4000
+    FLAG_STAGE = 0x3000
+    FLAG_NAME_LENGTH = 0x0FFF
+    EXTENDED_SKIP_WORKTREE = 0x4000
+    EXTENDED_INTENT_TO_ADD = 0x2000
+
+    #: Mtime of the index file itself, to detect racily clean entries
+    mtime_ns: int
+
+    #: Entries by posix path relative to the project root
+    entries: dict[str, IndexEntry]
+
+    def __init__(self, path):
+        """
+        Args:
+            path (Path): The path to the index file
+
+        Raises:
+            ValueError: if the index file is not valid
+        """
+        self.mtime_ns = path.stat().st_mtime_ns
+        self.entries = {}
+        self.parse(path.read_bytes())
+
+    def parse(self, data):
+        signature, version, count = self.HEADER.unpack_from(data, 0)
+        if signature != b"DIRC" or version not in (2, 3, 4):
+            raise ValueError("Unsupported git index")
+
+        offset = self.HEADER.size
+        previous = b""
+        for _ in range(count):
+            start = offset
+            (
+                ctime_s,
+                ctime_ns,
+                mtime_s,
+                mtime_ns,
+                dev,
+                ino,
+                mode,
+                uid,
+                gid,
+                size,
+                blob,
+                flags,
+            ) = self.ENTRY.unpack_from(data, offset)
+            offset += self.ENTRY.size
+
+            extended_flags = 0
+            if flags & self.FLAG_EXTENDED:
+                (extended_flags,) = struct.unpack_from(">H", data, offset)
+                offset += 2
+
+            if version == 4:
+                # Path is prefix-compressed against the previous entry's path
+                strip, offset = self._read_varint(data, offset)
+                end = data.index(b"\0", offset)
+                name = previous[: len(previous) - strip] + data[offset:end]
+                offset = end + 1
+            else:
+                end = data.index(b"\0", offset)
+                name = data[offset:end]
+                # Entries are padded with NULs to a multiple of 8 bytes
+                offset = start + ((end - start + 8) & ~7)
+            previous = name
+
+            self.entries[name.decode("utf-8", "surrogateescape")] = IndexEntry(
+                mtime_s=mtime_s,
+                mtime_ns=mtime_ns,
+                ino=ino,
+                size=size,
+                blob=blob.hex(),
+                flags=flags,
+                extended_flags=extended_flags,
+            )
+
+    @staticmethod
+    def _read_varint(data, offset):
+        """
+        Read git's offset varint encoding
+        """
+        byte = data[offset]
+        offset += 1
+        value = byte & 0x7F
+        while byte & 0x80:
+            byte = data[offset]
+            offset += 1
+            value = ((value + 1) << 7) | (byte & 0x7F)
+        return value, offset
+
+    def get_clean_blob(self, filename, path):
+        """
+        Return the blob id of a tracked file if its stat data matches the index, or
+        None if it may have changed since it was staged
+
+        Args:
+            filename (str): Posix path relative to the project root
+            path (Path): Path to the file in the working tree
+        """
+        entry = self.entries.get(filename)
+        if entry is None:
+            return None
+
+        if (
+            entry.flags & (self.FLAG_ASSUME_VALID | self.FLAG_STAGE)
+            or entry.extended_flags
+            & (self.EXTENDED_SKIP_WORKTREE | self.EXTENDED_INTENT_TO_ADD)
+        ):
+            return None
+
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+
+        mtime_ns = entry.mtime_s * 10**9 + entry.mtime_ns
+        if (
+            stat.st_mtime_ns != mtime_ns
+            or stat.st_size & 0xFFFFFFFF != entry.size
+            or stat.st_ino & 0xFFFFFFFF != entry.ino
+        ):
+            return None
+
+        # Racily clean - the file could have changed in the same timestamp tick as the
+        # index was written, so git itself wouldn't trust this entry
+        if mtime_ns >= self.mtime_ns:
+            return None
+
+        return entry.blob
+
+
+def read_gitdir(path):
+    """
+    Follow a ``.git`` file, as used by worktrees and submodules, to the git dir
+
+    Args:
+        path (Path): The path to the ``.git`` file
+
+    Returns:
+        Path | None: The git dir, or None if the file isn't a valid pointer
+    """
+    content = path.read_text().strip()
+    if not content.startswith("gitdir:"):
+        return None
+    gitdir = path.parent / content[len("gitdir:") :].strip()
+    return gitdir.resolve()
+
+
+class RefStore:
+    """
+    The refs in a git repository, read once into dicts
+
+    Reads ``packed-refs`` and the loose refs under ``refs/``, with loose refs taking
+    precedence. Loose refs are checked again when looked up by name, so new commits are
+    seen. The reverse index is read again when a lookup finds it out of date, such as
+    after a fetch has moved loose remote refs.
+    """
+
+    #: Path to the git dir which contains ``refs`` and ``packed-refs``
+    path = None
+
+    #: Ref names to commit SHAs
+    refs = None
+
+    #: Ref names to commit SHAs in ``packed-refs``, used when a loose ref is removed
+    packed = None
+
+    #: Symbolic ref names to the ref names they point to
+    symbolic = None
+
+    #: Commit SHAs to the names of the refs which point to them, in file order
+    shas = None
+
+    def __init__(self, path):
+        """
+        Args:
+            path (Path): The path to the common git dir
+        """
+        self.path = path
+        self.read()
+
+    def read(self):
+        """
+        Read all refs, and build the reverse index
+        """
+        self.refs = {}
+        self.packed = {}
+        self.symbolic = {}
+        self.read_packed_refs()
+        self.read_loose_refs()
+
+        self.shas = {}
+        for name, sha in self.refs.items():
+            self.shas.setdefault(sha, []).append(name)
+
+    def read_packed_refs(self):
+        packed_refs_path = self.path / "packed-refs"
+        if not packed_refs_path.is_file():
+            return
+
+        with packed_refs_path.open() as file:
+            for line in file:
+                # Skip comments, peeled tags and anything unexpected
+                if line.startswith(("#", "^")) or " " not in line:
+                    continue
+
+                # Typical line:
+                #   1234567890abcdef refs/remotes/origin/develop
+                commit_hash, name = line.rstrip("\n").split(" ", 1)
+                self.packed[name] = commit_hash
+                self.refs[name] = commit_hash
+
+    def read_loose_refs(self):
+        for dirpath, dirnames, filenames in os.walk(self.path / "refs"):
+            for filename in filenames:
+                ref_path = os.path.join(dirpath, filename)
+                name = os.path.relpath(ref_path, self.path).replace(os.sep, "/")
+                self.set_loose(name, self.read_loose(name))
+
+    def read_loose(self, name):
+        """
+        Read a loose ref file, returning its content or None if it doesn't exist
+        """
+        try:
+            with open(self.path / name) as file:
+                return file.read().strip()
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def set_loose(self, name, value):
+        """
+        Record the content of a loose ref file, or None if it has been removed
+        """
+        if not value:
+            # Removed, so only the packed ref is left, if there is one
+            self.symbolic.pop(name, None)
+            if name in self.packed:
+                self.refs[name] = self.packed[name]
+            else:
+                self.refs.pop(name, None)
+        elif value.startswith("ref: "):
+            self.symbolic[name] = value[len("ref: ") :]
+            self.refs.pop(name, None)
+        else:
+            self.refs[name] = value
+            self.symbolic.pop(name, None)
+
+    def get(self, name):
+        """
+        Resolve a ref name to a commit SHA, following symbolic refs
+
+        Returns:
+            str | None: The commit SHA, or None if the ref doesn't exist
+        """
+        for _ in range(5):
+            self.set_loose(name, self.read_loose(name))
+
+            if name in self.symbolic:
+                name = self.symbolic[name]
+                continue
+            return self.refs.get(name)
+        return None
+
+    def get_names(self, commit_hash):
+        """
+        Find the names of the refs which point to a commit
+
+        If nothing points to the commit, or a ref found no longer does, the refs are
+        read again in case they have changed since the index was built.
+        """
+        names = self.shas.get(commit_hash, [])
+        if not names or any(self.get(name) != commit_hash for name in names):
+            self.read()
+            names = self.shas.get(commit_hash, [])
+        return names
+
+
+#: Ref stores by common git dir, cached for the life of the process along with the
+#: signature of ``packed-refs`` when they were read
+_ref_stores = {}
+
+
+def get_ref_store(path):
+    """
+    Get the ref store for a common git dir, reading it again if ``packed-refs`` changes
+
+    Args:
+        path (Path): The path to the common git dir
+    """
+    try:
+        stat = (path / "packed-refs").stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        signature = None
+
+    cached = _ref_stores.get(path)
+    if cached is None or cached[0] != signature:
+        cached = _ref_stores[path] = (signature, RefStore(path))
+    return cached[1]
+
+
 class Repo:
     """
     Represent a local git repository
     """
 
-    #: Path to ``.git`` repo
+    #: Path to the git dir, containing ``HEAD`` and ``index``. For a worktree this is
+    #: the worktree's own dir inside the main repository's ``.git`` dir.
     path = None
 
+    #: Path to the git dir which contains ``config`` and refs shared between worktrees
+    common_path = None
+
+    #: Path to the working tree
+    work_tree = None
+
     #: Name of the remote in ``.git/config``
     remote_name = None
 
+    #: Parsed config, read once by ``get_config``
+    _config = None
+
     BRANCH_PATTERN = re.compile(r"^ref: refs/heads/(?P<branch>.+)$")
 
     def __init__(self, path, remote_name=DEFAULT_REMOTE):
@@ -31,24 +374,42 @@ class Repo:
         Initialise a repo wrapper
 
         Args:
-            path (Path): The path to the .git repo
+            path (Path): The path to the .git repo, or a ``.git`` file which points to
+                it for worktrees and submodules
         """
-        if not path.is_dir():
+        work_tree = path.parent
+        if path.is_file():
+            path = read_gitdir(path)
+
+        if path is None or not path.is_dir():
             # If the pass doesn't exist then leave path as None so we can skip
             # unnecessary checks
             return
 
         self.path = path
+        self.common_path = path
+        self.work_tree = work_tree
         self.remote_name = remote_name
 
-    def get_remote_url(self):
+        commondir_path = path / "commondir"
+        if commondir_path.is_file():
+            self.common_path = (path / commondir_path.read_text().strip()).resolve()
+
+    @property
+    def refs(self):
         """
-        Find the URL for the current remote
+        The ref store, shared by every Repo for the same repository in this process
         """
-        if self.path is None:
-            return None
+        return get_ref_store(self.common_path)
 
-        config_path = self.path / "config"
+    def get_config(self):
+        """
+        Read the config file once, or return None if it doesn't exist
+        """
+        if self._config is not None:
+            return self._config
+
+        config_path = self.common_path / "config"
         if not config_path.is_file():
             return None
 
@@ -67,6 +428,20 @@ class Repo:
             # sphinx 5
             config.read_file(config_io)
 
+        self._config = config
+        return config
+
+    def get_remote_url(self):
+        """
+        Find the URL for the current remote
+        """
+        if self.path is None:
+            return None
+
+        config = self.get_config()
+        if config is None:
+            return None
+
         try:
             url = config.get(f'remote "{self.remote_name}"', "url")
         except NoSectionError:
@@ -74,6 +449,68 @@ class Repo:
 
         return url
 
+    def get_index(self):
+        """
+        Read the index, or return None if it doesn't exist or can't be read
+        """
+        if self.path is None:
+            return None
+
+        index_path = self.path / "index"
+        if not index_path.is_file():
+            return None
+
+        try:
+            return Index(index_path)
+        except (ValueError, struct.error):
+            return None
+
+    def get_head_commit(self):
+        """
+        The SHA of the commit currently checked out, or None if there isn't one
+        """
+        if self.path is None:
+            return None
+
+        git_head_path = self.path / "HEAD"
+        if not git_head_path.is_file():
+            return None
+        git_head = git_head_path.read_text().strip()
+
+        # A detached head is the commit itself
+        if not git_head.startswith("ref: "):
+            return git_head
+
+        return self.refs.get(git_head[len("ref: ") :])
+
+    def get_changed_paths(self, commit):
+        """
+        Find the paths which differ between a commit and the working tree
+
+        Runs a single ``git diff``, so includes staged and unstaged changes to tracked
+        files, but not untracked files.
+
+        Returns:
+            set[str] | None: Posix paths relative to the project root, or None if git
+            isn't available or doesn't know the commit
+        """
+        if self.path is None:
+            return None
+
+        try:
+            result = run(
+                ["git", "diff", "--name-only", "--no-renames", "-z", commit, "--"],
+                cwd=self.work_tree,
+                stdout=PIPE,
+                stderr=DEVNULL,
+                check=True,
+            )
+        except (OSError, CalledProcessError):
+            return None
+
+        paths = result.stdout.decode("utf-8", "surrogateescape").split("\0")
+        return {path for path in paths if path}
+
     def get_local_branch(self):
         """
         The current branch name
@@ -92,23 +529,10 @@ class Repo:
         if matches:
             return matches.group("branch")
 
-        # We're on a detached head, likely readthedocs; try to look it up in packed-refs
-        packed_refs_path = self.path / "packed-refs"
-        if not packed_refs_path.is_file():
-            return None
-
-        packed_refs_raw = packed_refs_path.read_text()
+        # We're on a detached head, likely readthedocs; try to find a remote branch
         remote_ref_prefix = f"refs/remotes/{self.remote_name}/"
-        for line in packed_refs_raw.splitlines():
-            # Skip irrelevant lines
-            if line.startswith("#") or " " not in line:
-                continue
-
-            # Typical line:
-            #   1234567890abcdef refs/remotes/origin/develop
-            commit_hash, ref = line.split(" ", 1)
-            if commit_hash == git_head and ref.startswith(remote_ref_prefix):
-                ref = ref[len(remote_ref_prefix) :]
-                return ref
+        for ref in self.refs.get_names(git_head):
+            if ref.startswith(remote_ref_prefix):
+                return ref[len(remote_ref_prefix) :]
 
         return None
@@ -3,23 +3,35 @@ from __future__ import annotations
 import ast
 import hashlib
 import json
-from multiprocessing import Queue
-from typing import TYPE_CHECKING
+import os
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Iterable
 
 from sphinx.errors import SphinxError
-
-if TYPE_CHECKING:
-    from pathlib import Path
 from sphinx.util.logging import getLogger
 
+from .cache import SymbolCache, get_stat_signature
+from .constants import (
+    DEFAULT_HASH_MODE,
+    DEFAULT_IGNORE_PATTERNS,
+    DEFAULT_MODULE_CACHE_SIZE,
+    DEFAULT_STREAM_THRESHOLD,
+    PARALLEL_CHECK_THRESHOLD,
+)
 from .exceptions import ParseError
-from .parser import python_to_node
+from .git import Index, Repo
+from .parser import ModuleCache, ParsedModule, parsed_module_to_node
 
 logger = getLogger("sphinx_gitref")
 
 
 #: Current hash file format version
-FILE_VERSION = 1
+FILE_VERSION = 2
+
+#: Size of the chunks used when streaming a file to be hashed
+HASH_CHUNK_SIZE = 1024 * 1024
 
 
 def hash_text(text: str):
@@ -27,16 +39,153 @@ def hash_text(text: str):
     return hash
 
 
-def hash_file(path: Path):
-    src = path.read_text()
+def hash_file(path: Path, stream_threshold: int = DEFAULT_STREAM_THRESHOLD):
+    """
+    Hash the raw bytes of a file
+
+    Files of ``stream_threshold`` bytes or more are hashed in chunks instead of being
+    read into memory.
+    """
+    if path.stat().st_size < stream_threshold:
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+
+    with path.open("rb") as file:
+        if hasattr(hashlib, "file_digest"):
+            # Python 3.11+
+            return hashlib.file_digest(file, "sha256").hexdigest()
+
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+def hash_file_text(path: Path):
+    """
+    Hash the decoded text of a file, as hash files before 0.5.0 did
+
+    This only differs from ``hash_file`` for files with Windows line endings or which
+    aren't UTF-8. Returns None if the file can't be decoded.
+    """
+    try:
+        src = path.read_text()
+    except UnicodeDecodeError:
+        return None
     return hash_text(src)
 
 
+def walk_dir(path: Path, ignore_patterns: list[str]):
+    """
+    Generate the relative posix paths and full paths of files in a directory, in a
+    stable order
+
+    Files and directories matching any of the ``ignore_patterns`` are skipped.
+    """
+
+    def ignored(name):
+        return any(fnmatch(name, pattern) for pattern in ignore_patterns)
+
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(name for name in dirnames if not ignored(name))
+        rel = os.path.relpath(dirpath, path).replace(os.sep, "/")
+        for name in sorted(filenames):
+            if ignored(name):
+                continue
+            yield (name if rel == "." else f"{rel}/{name}"), os.path.join(dirpath, name)
+
+
 def hash_node(node: ast.AST):
     src = ast.unparse(node)
     return hash_text(src)
 
 
+def hash_node_source(node: ast.AST, parsed: ParsedModule):
+    """
+    Hash the original source of a node, without regenerating it from the AST
+    """
+    return hashlib.sha256(parsed.segment(node)).hexdigest()
+
+
+def hash_node_structure(node: ast.AST, memo: dict[int, tuple[ast.AST, bytes]]):
+    """
+    Hash the structure of a node, ignoring comments, formatting and positions
+
+    Each node's digest is built from its type, its field values and the digests of its
+    children, so it is a Merkle tree. Digests are stored in ``memo`` by node id, so
+    nested coderefs into the same module only hash each node once. The node is stored
+    with its digest to keep it alive, so its id can't be reused by another node.
+    """
+    stack = [(node, False)]
+    while stack:
+        current, expanded = stack.pop()
+        if id(current) in memo:
+            continue
+
+        if not expanded:
+            # Hash the children first
+            stack.append((current, True))
+            stack.extend(
+                (child, False)
+                for child in ast.iter_child_nodes(current)
+                if id(child) not in memo
+            )
+            continue
+
+        digest = hashlib.sha256(type(current).__name__.encode())
+        for field in current._fields:
+            value = getattr(current, field, None)
+            digest.update(b"\0" + field.encode())
+            if isinstance(value, list):
+                digest.update(b"[%d" % len(value))
+                for item in value:
+                    digest.update(_structure_value(item, memo))
+            else:
+                digest.update(_structure_value(value, memo))
+        memo[id(current)] = (current, digest.digest())
+
+    return memo[id(node)][1].hex()
+
+
+def _structure_value(value, memo: dict[int, tuple[ast.AST, bytes]]) -> bytes:
+    if isinstance(value, ast.AST):
+        return b"N" + memo[id(value)][1]
+    return b"V" + repr(value).encode("utf-8") + b"\0"
+
+
+#: Hasher used by a check worker process - see Hasher.check_parallel
+_worker_hasher = None
+
+
+def _init_worker(options: dict):
+    global _worker_hasher
+    _worker_hasher = Hasher(**options)
+
+
+def _check_targets(targets: list[str]) -> tuple[dict, dict, dict, dict]:
+    """
+    Check a batch of targets in a worker process
+
+    Returns the resolved targets, errors, lines and symbol cache entries for the batch
+    """
+    hasher = _worker_hasher
+    for target in targets:
+        hasher.find_target(target, checking=True)
+
+    entries = hasher.symbols.entries
+    validated = hasher.symbols.validated
+    result = (
+        {target: hasher.resolved[target] for target in targets},
+        dict(hasher.errors),
+        {target: hasher.lines[target] for target in targets if target in hasher.lines},
+        {filename: entries[filename] for filename in validated},
+    )
+
+    # Start the next batch fresh, so results aren't returned twice
+    hasher.errors.clear()
+    validated.clear()
+    return result
+
+
 class Hasher:
     #: hash file
     file: Path
@@ -47,6 +196,9 @@ class Hasher:
     #: if we're updating the hash file, or checking it
     updating: bool
 
+    #: How coderefs are hashed - one of ``constants.HASH_MODES``
+    hash_mode: str
+
     #: Track whether we've finished processing and reporting
     finished: bool = False
 
@@ -56,6 +208,26 @@ class Hasher:
     #: Line numbers for code references
     lines: dict[str, int]
 
+    #: Stat signatures of referenced files at the last update - see
+    #: ``cache.get_stat_signature``
+    stats: dict[str, list[int]]
+
+    #: Whether each referenced file's stat signature matches ``stats``
+    unchanged: dict[str, bool]
+
+    #: Digests of referenced files at the last update - see ``hash_file``
+    digests: dict[str, str]
+
+    #: Git blob ids of whole-file targets which were clean in the git index when the
+    #: hash file was last updated
+    blobs: dict[str, str]
+
+    #: Commit checked out when the hash file was last updated
+    commit: str | None
+
+    #: Referenced files which differed from ``commit`` when the hash file was updated
+    dirty: list[str]
+
     #: Status of the hashes - checked at the start, rendered during role to make it
     #: easier to find references
     status: dict[str, bool]
@@ -69,58 +241,166 @@ class Hasher:
     #: Errors from checks
     errors: dict[str, str]
 
-    # Queues used internally to allow parallel document processing
-    hash_queue: Queue
-    line_queue: Queue
-    used_queue: Queue
-    error_queue: Queue
-
-    def __init__(self, file: Path, project_root: Path, hashing: bool, updating: bool):
+    #: Targets which have been resolved in this build, and whether they were found
+    resolved: dict[str, bool]
+
+    #: Parsed Python files, shared by the check and every role in this build
+    modules: ModuleCache
+
+    #: Resolved coderefs, persisted between builds
+    symbols: SymbolCache
+
+    def __init__(
+        self,
+        file: Path,
+        project_root: Path,
+        hashing: bool,
+        updating: bool,
+        module_cache_size: int = DEFAULT_MODULE_CACHE_SIZE,
+        cache_file: Path | None = None,
+        lazy_parsing: bool = False,
+        hash_mode: str = DEFAULT_HASH_MODE,
+        stream_threshold: int = DEFAULT_STREAM_THRESHOLD,
+        ignore_patterns: list[str] = DEFAULT_IGNORE_PATTERNS,
+        repo: Repo | None = None,
+        use_git_index: bool = False,
+        paranoid: bool = False,
+        workers: int | None = None,
+        changed_only: bool = False,
+        prune: bool = False,
+    ):
         self.file = file
         self.project_root = project_root
         self.hashing = hashing
         self.updating = updating
+        self.hash_mode = hash_mode
+        self.stream_threshold = stream_threshold
+        self.ignore_patterns = ignore_patterns
+        self.repo = repo
+        self.use_git_index = use_git_index and repo is not None
+        self.paranoid = paranoid
+        self.changed_only = changed_only
+        self.prune = prune
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self._git_index = None
+        self.modules = ModuleCache(maxsize=module_cache_size, lazy=lazy_parsing)
 
         # Data from file
         self.hashes = {}
         self.lines = {}
+        self.stats = {}
+        self.digests = {}
+        self.blobs = {}
+        self.commit = None
+        self.dirty = []
 
         # Track checks
         self.name_ref = {}
+        self.unchanged = {}
         self.used = set()
         self.errors = {}
-
-        self.hash_queue = Queue()
-        self.line_queue = Queue()
-        self.used_queue = Queue()
-        self.error_queue = Queue()
+        self.resolved = {}
 
         self.load()
 
+        # Symbols are cached with their hashes, so need to know the final hash mode
+        self.symbols = SymbolCache(
+            cache_file,
+            self.hash_mode,
+            digest_file=lambda path: hash_file(path, self.stream_threshold),
+        )
+
     def load(self):
         """
         Load the hash file, if we need it and it exists
+
+        When updating, the existing hashes are loaded so that they can be merged with
+        the targets found in the documents which are read again.
         """
-        # No need to load it if we're updating or not hashing, we'll ignore it anyway
-        if self.updating or not self.hashing:
+        # No need to load it if we're not hashing, we'll ignore it anyway
+        if not self.hashing:
             return
 
         # It's ok if the file doesn't exist, maybe gitref is installed but not used.
         # If it is used and the file should exist, we'll find out when checking.
         if not self.file.exists():
-            logger.info(f"gitref hash file not found at {self.file}")
+            if not self.updating:
+                logger.info(f"gitref hash file not found at {self.file}")
             self.refs = {}
             return
 
         refs = json.load(self.file.open())
-        if refs["version"] != FILE_VERSION:
+
+        # Hashes made by another version or in another mode can't be merged, so a
+        # full update is needed
+        hash_mode = refs.get("hash_mode", "unparse")
+        if self.updating and (
+            refs["version"] not in (1, FILE_VERSION) or hash_mode != self.hash_mode
+        ):
+            return
+
+        if refs["version"] == 1:
+            self.hashes = refs["hashes"]
+            self.lines = refs["lines"]
+            self.stats = refs.get("stats", {})
+            self.blobs = refs.get("blobs", {})
+        elif refs["version"] == FILE_VERSION:
+            self.load_files(refs["files"])
+        else:
             raise ValueError(
                 "Unexpected hash file version"
-                f" - code understands {FILE_VERSION}, file is {refs['version']}"
+                f" - code understands 1 to {FILE_VERSION}, file is {refs['version']}"
             )
 
-        self.hashes = refs["hashes"]
-        self.lines = refs["lines"]
+        self.commit = refs.get("commit")
+        self.dirty = refs.get("dirty", [])
+
+        # Check with the mode the file was built with; files from before hash modes
+        # were introduced used ast.unparse
+        self.hash_mode = hash_mode
+
+    def load_files(self, files: dict[str, dict]):
+        """
+        Load the per-file entries of a version 2 hash file
+        """
+        for filename, entry in files.items():
+            if "hash" in entry:
+                self.hashes[filename] = entry["hash"]
+            if "blob" in entry:
+                self.blobs[filename] = entry["blob"]
+            if "stat" in entry:
+                self.stats[filename] = entry["stat"]
+            if "digest" in entry:
+                self.digests[filename] = entry["digest"]
+            for coderef, (hashed, line) in entry.get("coderefs", {}).items():
+                target = f"{filename}::{coderef}"
+                self.hashes[target] = hashed
+                self.lines[target] = line
+
+    def dump_files(self) -> dict[str, dict]:
+        """
+        Group the hashes by file, for a version 2 hash file
+        """
+        files = {}
+        for target, hashed in sorted(self.hashes.items()):
+            filename, coderef = self.split_target(target)
+            entry = files.setdefault(filename, {})
+            if coderef is None:
+                entry["hash"] = hashed
+                if target in self.blobs:
+                    entry["blob"] = self.blobs[target]
+            else:
+                entry.setdefault("coderefs", {})[coderef] = [
+                    hashed,
+                    self.lines.get(target),
+                ]
+
+        for filename, entry in files.items():
+            if filename in self.stats:
+                entry["stat"] = self.stats[filename]
+            if filename in self.digests:
+                entry["digest"] = self.digests[filename]
+        return files
 
     def split_target(self, target: str) -> tuple[str, str | None]:
         """
@@ -140,34 +420,233 @@ class Hasher:
         Run a full check of the hash file against the code
 
         This will pre-populate a shared cache when processing in parallel
+
+        If ``changed_only=True``, only targets in files which git reports have changed
+        since the last update are checked.
+        """
+        targets = None
+        if self.changed_only:
+            targets = self.get_changed_targets()
+        if targets is None:
+            targets = list(self.hashes)
+
+        if self.workers > 1 and len(targets) >= PARALLEL_CHECK_THRESHOLD:
+            self.check_parallel(targets)
+        else:
+            self.find_targets(targets, checking=True)
+
+    def get_changed_targets(self) -> list[str] | None:
         """
-        for target, hash in self.hashes.items():
-            self.find_target(target, checking=True)
-        self.collect_queues()
+        Find targets in files which may have changed since the hash file was updated,
+        and trust the rest without checking them
+
+        A file may have changed if it differs from the commit recorded at the last
+        update, differed from it at the time, or isn't tracked by git. Directories
+        aren't tracked by git, so are always checked.
+
+        Returns None if git can't say what has changed
+        """
+        if self.commit is None or self.repo is None:
+            logger.info("gitref hash file has no commit, checking all targets")
+            return None
+
+        changed = self.repo.get_changed_paths(self.commit)
+        index = self.repo.get_index()
+        if changed is None or index is None:
+            logger.info(
+                f"gitref could not find changes since {self.commit}, checking all"
+                " targets"
+            )
+            return None
+        changed.update(self.dirty)
+
+        targets = []
+        for target in self.hashes:
+            filename, coderef = self.split_target(target)
+            if filename in changed or filename not in index.entries:
+                targets.append(target)
+            else:
+                self.resolved[target] = True
+
+        logger.info(
+            f"gitref checking {len(targets)} of {len(self.hashes)} targets,"
+            f" changed since {self.commit[:12]}"
+        )
+        return targets
+
+    def check_parallel(self, targets: list[str]):
+        """
+        Check the hash file against the code using a pool of worker processes
+
+        Targets are grouped by file so that each file is only parsed by one worker, and
+        the results are merged back into this hasher.
+        """
+        groups = {}
+        for target in targets:
+            filename, coderef = self.split_target(target)
+            groups.setdefault(filename, []).append(target)
+
+        # Split the groups into a few batches per worker to balance the load
+        batches = [[] for _ in range(self.workers * 4)]
+        for i, group in enumerate(groups.values()):
+            batches[i % len(batches)].extend(group)
+
+        options = {
+            "file": self.file,
+            "project_root": self.project_root,
+            "hashing": self.hashing,
+            "updating": self.updating,
+            "module_cache_size": self.modules.maxsize,
+            "cache_file": self.symbols.file,
+            "lazy_parsing": self.modules.lazy,
+            "hash_mode": self.hash_mode,
+            "stream_threshold": self.stream_threshold,
+            "ignore_patterns": self.ignore_patterns,
+            "repo": self.repo,
+            "use_git_index": self.use_git_index,
+            "paranoid": self.paranoid,
+            "workers": 1,
+        }
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(options,),
+        ) as executor:
+            for resolved, errors, lines, entries in executor.map(
+                _check_targets, [batch for batch in batches if batch]
+            ):
+                self.resolved.update(resolved)
+                self.errors.update(errors)
+                self.lines.update(lines)
+                if entries:
+                    self.symbols.entries.update(entries)
+                    self.symbols.changed = True
 
     def error(self, target: str, message: str):
         """
         Log an error
+        """
+        self.errors[target] = message
 
-        When running in parallel, the current process needs to know the error has
-        occurred, but the main process also needs to find out.
+    def get_result(self, target: str) -> tuple:
+        """
+        Return the ``(hash, line, error, stat, digest, blob)`` found for a target
 
-        This writes to the local self.errors so it's available immediately, and also
-        writes to the error_queue so it's picked up at the end
+        Documents read in parallel store these in the environment, to be merged back
+        into the main process's hasher with ``merge_results``. The stat signature and
+        digest are of the target's file, and are only used when updating.
         """
-        self.errors[target] = message
-        self.error_queue.put((target, message))
+        filename, coderef = self.split_target(target)
+        return (
+            self.hashes.get(target),
+            self.lines.get(target),
+            self.errors.get(target),
+            self.stats.get(filename),
+            self.digests.get(filename),
+            self.blobs.get(target),
+        )
+
+    def merge_results(self, results: dict[str, tuple | None]):
+        """
+        Merge results from ``get_result`` which were found in another process
+
+        A result of None is a deferred target, which is only marked as used.
+        """
+        for target, result in results.items():
+            self.used.add(target)
+            if result is None:
+                # Deferred, resolved once all documents have been read
+                continue
+            hashed, line, error, stat, digest, blob = result
+            if error is not None:
+                self.errors[target] = error
+                continue
+            if line is not None:
+                self.lines[target] = line
+            if hashed is not None and (self.updating or not self.hashing):
+                self.hashes[target] = hashed
+
+            if self.updating:
+                self.merge_file_state(target, stat, digest, blob)
+
+    def merge_file_state(self, target: str, stat, digest, blob):
+        """
+        Record the state of a target's file as it was found in another process, so the
+        hash file is written with the stat signature and digest which were hashed
+        """
+        filename, coderef = self.split_target(target)
+        if digest is not None:
+            # Files are always digested when updating, so the stat was recorded too; a
+            # missing stat signature means it was too recent to be trusted
+            self.digests[filename] = digest
+            if stat is not None:
+                self.stats[filename] = stat
+            else:
+                self.stats.pop(filename, None)
+        if coderef is None:
+            if blob is not None:
+                self.blobs[target] = blob
+            else:
+                self.blobs.pop(target, None)
 
     def find_target(self, target: str, checking=False):
         """
         Find the specified target and check it against the cache, or update the cache if
         ``self.updating=True``.
 
+        Each target is only resolved once per build; later calls return the same result.
+
         If ``checking=True`` then this will not be logged to ``self.used``
         """
-        filename, coderef = self.split_target(target)
         if not checking:
-            self.used_queue.put(target)
+            self.used.add(target)
+
+        found = self.resolved.get(target)
+        if found is None:
+            found = self.resolved[target] = self.resolve_target(target)
+        return found
+
+    def find_targets(self, targets: Iterable[str], checking=False):
+        """
+        Find several targets at once, grouped by source file
+
+        Each file is opened, parsed and indexed once for all of its targets, however
+        small the module cache.
+        """
+
+        def by_file(target):
+            filename, coderef = self.split_target(target)
+            return filename, coderef or ""
+
+        for target in sorted(set(targets), key=by_file):
+            self.find_target(target, checking=checking)
+
+    def forget(self, filename: str):
+        """
+        Forget what was found for the targets in a file, so they are resolved again
+
+        Used when watching for changes; parsed modules are validated by the module
+        cache. If the file is a directory, the digests of the files it contains are
+        validated again too.
+        """
+        for target, (target_filename, coderef) in self.name_ref.items():
+            if target_filename == filename:
+                self.resolved.pop(target, None)
+                self.errors.pop(target, None)
+        self.unchanged.pop(filename, None)
+
+        prefix = filename.rstrip("/") + "/"
+        self.symbols.validated = {
+            validated
+            for validated in self.symbols.validated
+            if validated != filename and not validated.startswith(prefix)
+        }
+
+    def resolve_target(self, target: str):
+        """
+        Resolve a target, and check or update its hash
+        """
+        filename, coderef = self.split_target(target)
 
         # Ensure the file exists - can be a file or a dir
         filepath = self.project_root / filename
@@ -175,16 +654,57 @@ class Hasher:
             self.error(target, "File not found")
             return False
 
+        # Compare against the last update before recording the file as it is now
+        unchanged = target in self.hashes and self.is_unchanged(filename, filepath)
+
+        if self.updating and not filepath.is_dir():
+            signature = get_stat_signature(filepath)
+            if signature is not None:
+                self.stats[filename] = signature
+            else:
+                self.stats.pop(filename, None)
+            self.digests[filename] = self.symbols.digest(filename, filepath)
+
+        if unchanged:
+            # Untouched since the last update, so the hash and line must still match
+            return True
+
         elif coderef is None:
-            hashed = hash_file(filepath)
+            blob = None
+            if filepath.is_dir():
+                hashed = self.hash_dir(filepath, filename)
+            else:
+                if self.git_index is not None:
+                    blob = self.git_index.get_clean_blob(filename, filepath)
+
+                if (
+                    blob is not None
+                    and not self.updating
+                    and target in self.hashes
+                    and self.blobs.get(target) == blob
+                ):
+                    # Git has already confirmed the contents match the last update
+                    hashed = self.hashes[target]
+                else:
+                    hashed = self.symbols.digest(filename, filepath)
+
+            if self.updating:
+                if blob is not None:
+                    self.blobs[target] = blob
+                else:
+                    self.blobs.pop(target, None)
+
             if self.updating or not self.hashing:
-                # Put it in both the dict for local access, and the queue for parallel
                 self.hashes[target] = hashed
-                self.hash_queue.put((target, hashed))
             elif target not in self.hashes:
                 self.error(target, "Unknown target")
-            elif self.hashing and self.hashes[target] != hashed:
-                # Add to both local errors and the error queue in case multiprocessing
+            elif (
+                self.hashing
+                and self.hashes[target] != hashed
+                and (
+                    filepath.is_dir() or self.hashes[target] != hash_file_text(filepath)
+                )
+            ):
                 self.error(target, "Target changed")
             else:
                 # target is in hashes and matches
@@ -193,17 +713,15 @@ class Hasher:
         else:
             # Convert a code ref into a line number
             try:
-                node = python_to_node(filepath, coderef)
+                lineno, hashed = self.find_coderef(filepath, filename, coderef)
             except ParseError as error:
-                self.errors[target] = str(error)
+                self.error(target, str(error))
                 return False
             else:
-                self.lines[target] = node.lineno
-                hashed = hash_node(node)
+                self.lines[target] = lineno
 
                 if self.updating or not self.hashing:
                     self.hashes[target] = hashed
-                    self.hash_queue.put((target, hashed))
                 elif target not in self.hashes:
                     self.error(target, "Unknown target")
                 elif self.hashing and self.hashes[target] != hashed:
@@ -214,6 +732,92 @@ class Hasher:
 
         return True
 
+    def is_unchanged(self, filename: str, filepath: Path) -> bool:
+        """
+        Check if a file is the same as it was at the last update, in which case all of
+        its targets can be trusted
+
+        The file's stat signature is compared first, then its digest, so it is only read
+        if it has been touched.
+
+        Always False with ``paranoid=True``
+        """
+        if not self.hashing or self.paranoid:
+            return False
+
+        if filename not in self.unchanged:
+            stat = self.stats.get(filename)
+            digest = self.digests.get(filename)
+            self.unchanged[filename] = (
+                stat is not None and get_stat_signature(filepath) == stat
+            ) or (
+                digest is not None and self.symbols.digest(filename, filepath) == digest
+            )
+        return self.unchanged[filename]
+
+    def is_current(self, target: str) -> bool:
+        """
+        Check if the stored hash and line for a target can be kept by an incremental
+        update, because its file hasn't changed since the last update
+        """
+        if target not in self.hashes:
+            return False
+
+        filename, coderef = self.split_target(target)
+        filepath = self.project_root / filename
+        return filepath.is_file() and self.is_unchanged(filename, filepath)
+
+    @property
+    def git_index(self) -> Index | None:
+        """
+        The git index, if enabled, read once per build
+        """
+        if self.use_git_index and self._git_index is None:
+            self._git_index = self.repo.get_index()
+            if self._git_index is None:
+                self.use_git_index = False
+        return self._git_index
+
+    def hash_dir(self, dirpath: Path, dirname: str):
+        """
+        Hash a directory as a Merkle tree of the digests of the files it contains
+
+        File digests come from the symbol cache, so only files whose stat signature has
+        changed are read.
+        """
+        digest = hashlib.sha256()
+        prefix = dirname.rstrip("/")
+        for rel, path in walk_dir(dirpath, self.ignore_patterns):
+            file_digest = self.symbols.digest(f"{prefix}/{rel}", Path(path))
+            digest.update(f"{rel}\0{file_digest}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def find_coderef(self, filepath: Path, filename: str, coderef: str):
+        """
+        Resolve a coderef to its line number and hash
+
+        Uses the symbol cache if the file hasn't changed since it was last parsed
+        """
+        cached = self.symbols.get(filename, filepath, coderef)
+        if cached is not None:
+            lineno, end_lineno, hashed = cached
+            return lineno, hashed
+
+        if filepath.suffix != ".py":
+            raise ParseError("Source file is not Python")
+        parsed = self.modules.get(filepath)
+        node = parsed_module_to_node(parsed, coderef)
+        if self.hash_mode == "source":
+            hashed = hash_node_source(node, parsed)
+        elif self.hash_mode == "structural":
+            hashed = hash_node_structure(node, parsed.fingerprints)
+        else:
+            hashed = hash_node(node)
+        self.symbols.set(
+            filename, filepath, coderef, node.lineno, node.end_lineno, hashed
+        )
+        return node.lineno, hashed
+
     def finish(self):
         """
         Called once all the docs have been processed
@@ -224,28 +828,17 @@ class Hasher:
             return
         self.finished = True
 
-        self.collect_queues()
+        logger.verbose(
+            f"gitref module cache: {self.modules.hits} hits,"
+            f" {self.modules.misses} misses"
+        )
+
+        self.symbols.save()
         if self.hashing and self.updating:
             self.build_file()
         else:
             self.report()
 
-    def collect_queues(self):
-        for data_dict, queue in [
-            (self.hashes, self.hash_queue),
-            (self.lines, self.line_queue),
-            (self.errors, self.error_queue),
-        ]:
-            while not queue.empty():
-                key, value = queue.get()
-                data_dict[key] = value
-
-        for data_set, queue in [
-            (self.used, self.used_queue),
-        ]:
-            while not queue.empty():
-                data_set.add(queue.get())
-
     def build_file(self):
         """
         Use the found code references to build the hash file
@@ -256,13 +849,59 @@ class Hasher:
                 "\n".join(f"{target}: {error}" for target, error in self.errors.items())
             )
 
+        if self.prune:
+            self.prune_unused()
+
+        # Files from older versions are migrated without their digests, which are only
+        # known once the next update has hashed the files again
+        if self.updating:
+            commit, dirty = self.get_commit()
+        else:
+            commit, dirty = self.commit, self.dirty
+
         self.file.touch()
         json.dump(
-            {"version": FILE_VERSION, "hashes": self.hashes, "lines": self.lines},
+            {
+                "version": FILE_VERSION,
+                "hash_mode": self.hash_mode,
+                "files": self.dump_files(),
+                "commit": commit,
+                "dirty": dirty,
+            },
             self.file.open("w"),
             indent=2,
         )
 
+    def prune_unused(self):
+        """
+        Remove targets which are no longer used by any document
+        """
+        unused = set(self.hashes) - self.used
+        for target in unused:
+            del self.hashes[target]
+            self.lines.pop(target, None)
+            self.blobs.pop(target, None)
+
+        if unused:
+            logger.info(f"gitref pruned {len(unused)} unused targets")
+
+    def get_commit(self) -> tuple[str | None, list[str]]:
+        """
+        Find the current commit, and which referenced files differ from it
+        """
+        commit = None
+        if self.repo is not None:
+            commit = self.repo.get_head_commit()
+        if commit is None:
+            return None, []
+
+        changed = self.repo.get_changed_paths(commit)
+        if changed is None:
+            return None, []
+
+        filenames = {self.split_target(target)[0] for target in self.hashes}
+        return commit, sorted(changed & filenames)
+
     def report(self):
         """
         Report on the run and raise an exception
@@ -2,7 +2,13 @@
 Parse python source
 """
 import ast
+import io
+import keyword
+import tokenize
+from collections import OrderedDict
+from typing import NamedTuple
 
+from .constants import DEFAULT_MODULE_CACHE_SIZE
 from .exceptions import NodeNotFound, ParseError
 
 # Prep assignment node types:
@@ -80,7 +86,383 @@ def find_name_in_nodes(name, nodes, path=""):
     raise NodeNotFound(f'Couldn\'t find "{path}"')
 
 
-def python_to_node(path, ref):
+class Symbol(NamedTuple):
+    """
+    A named definition found in a module
+    """
+
+    lineno: int
+    end_lineno: int
+    node: ast.AST
+
+
+class SymbolIndex:
+    """
+    Map of every dotted name in a module to the node which defines it
+
+    Built from a single walk of the module so that each lookup is a dict lookup. Names
+    resolve the same way as ``find_name_in_nodes``: the first definition of a name wins,
+    and only function and class bodies are indexed beneath it.
+    """
+
+    def __init__(self, nodes):
+        self.symbols = {}
+
+        stack = [(nodes, "")]
+        while stack:
+            body, prefix = stack.pop()
+            for node in body:
+                if isinstance(node, ast.Assign):
+                    names = [
+                        target.id for target in node.targets if hasattr(target, "id")
+                    ]
+                elif isinstance(node, ast.AnnAssign):
+                    names = [node.target.id] if hasattr(node.target, "id") else []
+                elif type(node) in (ast.FunctionDef, ast.ClassDef):
+                    names = [node.name]
+                else:
+                    continue
+
+                for name in names:
+                    path = f"{prefix}{name}"
+                    if path in self.symbols:
+                        continue
+                    self.symbols[path] = Symbol(node.lineno, node.end_lineno, node)
+
+                    if not isinstance(node, AssignTypes):
+                        stack.append((node.body, f"{path}."))
+
+    def __contains__(self, name):
+        return name in self.symbols
+
+    def lookup(self, name):
+        """
+        Find the Symbol for a dotted name
+
+        Raises:
+            NodeNotFound: the name isn't defined, with the same message
+                ``find_name_in_nodes`` would give
+        """
+        symbol = self.symbols.get(name)
+        if symbol is not None:
+            return symbol
+
+        # Find where the path broke for reporting purposes
+        parts = name.split(".")
+        for i in range(1, len(parts)):
+            path = ".".join(parts[:i])
+            parent = self.symbols.get(path)
+            if parent is None:
+                break
+            if isinstance(parent.node, AssignTypes):
+                raise NodeNotFound(f'Found "{path}" but cannot go further')
+        else:
+            path = name
+        raise NodeNotFound(f'Couldn\'t find "{path}"')
+
+
+class BlockLocator:
+    """
+    Find top-level definitions by tokenizing the source, and only parse the blocks which
+    are asked for
+
+    Tokenizing stops once the requested name has been found, and resumes from there for
+    the next lookup, so the source is tokenized at most once.
+
+    Raises ``tokenize.TokenError``, ``SyntaxError`` or ``ValueError`` if the source
+    can't be tokenized or a block can't be parsed.
+    """
+
+    def __init__(self, source):
+        self.lines = []
+        self.tokens = tokenize.generate_tokens(self.readline(source))
+        self.statements = self.find_statements()
+
+        #: Top-level name to the lines of the block which defines it, or to the
+        #: SymbolIndex of the block once it has been parsed
+        self.blocks = {}
+
+    def readline(self, source):
+        """
+        Return a readline function which keeps the lines it has read
+        """
+        readline = io.StringIO(source).readline
+
+        def read():
+            line = readline()
+            self.lines.append(line)
+            return line
+
+        return read
+
+    def find(self, name):
+        """
+        Return the SymbolIndex for the top-level block which defines name, or None if
+        it's not defined
+        """
+        while name not in self.blocks:
+            statement = next(self.statements, None)
+            if statement is None:
+                return None
+
+            start, end, names = statement
+            if names is None:
+                # Not a simple statement, parse it to find out what it defines
+                index = self.parse(start, end)
+                names = [name for name in index.symbols if "." not in name]
+                block = index
+            else:
+                block = (start, end)
+
+            for block_name in names:
+                self.blocks.setdefault(block_name, block)
+
+        block = self.blocks[name]
+        if isinstance(block, tuple):
+            block = self.blocks[name] = self.parse(*block)
+        return block
+
+    def parse(self, start, end):
+        """
+        Parse the lines of a block and index it, keeping the original line numbers
+        """
+        module = ast.parse("".join(self.lines[start - 1 : end]))
+        ast.increment_lineno(module, start - 1)
+        return SymbolIndex(module.body)
+
+    def find_statements(self):
+        """
+        Generate ``(start, end, names)`` for each top-level statement
+
+        ``names`` is the list of names the statement defines, or None if the statement
+        isn't simple enough to tell without parsing it. Decorators are included in the
+        block of the definition they decorate.
+        """
+        start = None
+        decorated = None
+        first = []
+        equals = 0
+        semicolon = False
+        indent = 0
+        depth = 0
+        new_line = True
+
+        for token in self.tokens:
+            if token.type == tokenize.INDENT:
+                indent += 1
+                continue
+            if token.type == tokenize.DEDENT:
+                indent -= 1
+                continue
+            if token.type == tokenize.NEWLINE:
+                new_line = True
+                continue
+            if token.type in (tokenize.NL, tokenize.COMMENT, tokenize.ENDMARKER):
+                continue
+
+            if new_line and indent == 0:
+                # A new top-level statement has started, so the last one has ended
+                if start is not None:
+                    if first[0].string == "@":
+                        decorated = decorated or start
+                    else:
+                        names = _statement_names(first, equals, semicolon)
+                        yield decorated or start, token.start[0] - 1, names
+                        decorated = None
+                start = token.start[0]
+                first = []
+                equals = 0
+                semicolon = False
+                depth = 0
+            new_line = False
+
+            if indent:
+                continue
+            if len(first) < 2:
+                first.append(token)
+            if token.type == tokenize.OP:
+                if token.string in ("(", "[", "{"):
+                    depth += 1
+                elif token.string in (")", "]", "}"):
+                    depth -= 1
+                elif depth == 0 and token.string == "=":
+                    equals += 1
+                elif depth == 0 and token.string == ";":
+                    semicolon = True
+
+        if start is not None and first[0].string != "@":
+            names = _statement_names(first, equals, semicolon)
+            yield decorated or start, len(self.lines), names
+
+
+def _statement_names(first, equals, semicolon):
+    """
+    Work out which names a top-level statement defines from its first two tokens and
+    the operators found outside brackets
+
+    Returns None if the statement needs to be parsed to be sure.
+    """
+    token = first[0]
+    if token.type == tokenize.NAME and keyword.iskeyword(token.string):
+        if token.string in ("def", "class"):
+            return [first[1].string]
+        return []
+
+    if semicolon:
+        return None
+
+    if token.type == tokenize.NAME and len(first) == 2:
+        if first[1].string == "=" and equals == 1:
+            return [token.string]
+        if first[1].string == ":":
+            return [token.string]
+
+    if equals == 0:
+        return []
+    return None
+
+
+class ParsedModule:
+    """
+    The source and AST of a Python file
+
+    The AST is parsed on first access. A parse failure is remembered so the file isn't
+    parsed again for every reference into it.
+
+    If ``lazy=True``, lookups use a BlockLocator to parse only the top-level blocks
+    they need, falling back to a full parse if the locator can't handle the source.
+    """
+
+    def __init__(self, source, lazy=False):
+        self.source = source
+        self._module = None
+        self._error = None
+        self._index = None
+        self._locator = BlockLocator(source) if lazy else None
+        self._encoded = None
+        self._line_offsets = None
+
+        #: Structural digests of nodes in this module, keyed by node id, so they can
+        #: be shared between nested coderefs. Each is stored as ``(node, digest)``
+        self.fingerprints = {}
+
+    @property
+    def module(self):
+        if self._error is not None:
+            raise ParseError(self._error)
+
+        if self._module is None:
+            try:
+                self._module = ast.parse(self.source)
+            except Exception as e:
+                self._error = str(e)
+                raise ParseError(self._error)
+
+        return self._module
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = SymbolIndex(self.module.body)
+        return self._index
+
+    @property
+    def line_offsets(self):
+        """
+        Byte offset of the start of each line in the UTF-8 encoded source, indexed by
+        ``lineno - 1``
+        """
+        if self._line_offsets is None:
+            self._encoded = self.source.encode("utf-8")
+            offsets = [0]
+            find = self._encoded.find
+            pos = find(b"\n")
+            while pos != -1:
+                offsets.append(pos + 1)
+                pos = find(b"\n", pos + 1)
+            self._line_offsets = offsets
+        return self._line_offsets
+
+    def segment(self, node):
+        """
+        Return the UTF-8 source bytes of a node, including any decorators
+        """
+        offsets = self.line_offsets
+        lineno = node.lineno
+        decorators = getattr(node, "decorator_list", None)
+        if decorators:
+            lineno = decorators[0].lineno
+        start = offsets[lineno - 1] + node.col_offset
+        end = offsets[node.end_lineno - 1] + node.end_col_offset
+        return self._encoded[start:end]
+
+    def lookup(self, name):
+        """
+        Find the Symbol for a dotted name
+
+        Raises:
+            NodeNotFound: the name isn't defined
+            ParseError: the source couldn't be parsed
+        """
+        if self._locator is not None and self._module is None:
+            top = name.split(".", 1)[0]
+            try:
+                index = self._locator.find(top)
+            except (tokenize.TokenError, SyntaxError, ValueError):
+                # Fall back to a full parse, which will report any errors properly.
+                # Its nodes replace any parsed from blocks, so drop their digests
+                self._locator = None
+                self.fingerprints.clear()
+            else:
+                if index is None:
+                    raise NodeNotFound(f'Couldn\'t find "{top}"')
+                return index.lookup(name)
+
+        return self.index.lookup(name)
+
+
+class ModuleCache:
+    """
+    Least-recently-used cache of parsed Python files
+
+    Entries are keyed by path, and are discarded when the file's mtime or size changes.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MODULE_CACHE_SIZE, lazy=False):
+        self.maxsize = maxsize
+        self.lazy = lazy
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """
+        Return the ParsedModule for the given path, reading it if necessary
+        """
+        stat = path.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+            self.entries.move_to_end(path)
+            return entry[1]
+
+        self.misses += 1
+        parsed = ParsedModule(path.read_text(), lazy=self.lazy)
+        self.entries[path] = (signature, parsed)
+        self.entries.move_to_end(path)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return parsed
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def python_to_node(path, ref, cache=None, lazy=False):
     """
     Look up a code reference in the specific python file and return the line number it
     is defined on
@@ -88,6 +470,9 @@ def python_to_node(path, ref):
     Args:
         path (Path): Path to python file to examine
         ref (str): Variable, function or class name to find
+        cache (ModuleCache): Optional cache to read the parsed file from
+        lazy (bool): Only parse the block containing the reference; ignored if a
+            cache is provided, which has its own setting
 
     Returns:
         start (int): Line number the reference starts on
@@ -100,12 +485,15 @@ def python_to_node(path, ref):
         raise ParseError("Source file is not Python")
 
     # Examine the file
-    raw = path.read_text()
+    if cache is None:
+        parsed = ParsedModule(path.read_text(), lazy=lazy)
+    else:
+        parsed = cache.get(path)
 
-    return python_string_to_node(raw, ref)
+    return parsed_module_to_node(parsed, ref)
 
 
-def python_string_to_node(raw, ref):
+def python_string_to_node(raw, ref, lazy=False):
     """
     Look up a code reference in the provided python source and return the line number it
     is defined on
@@ -113,6 +501,7 @@ def python_string_to_node(raw, ref):
     Args:
         filename (str): Path to python file to examine
         ref (str): Variable, function or class name to find
+        lazy (bool): Only parse the block containing the reference
 
     Returns:
         start (int): Line number the reference starts on
@@ -120,14 +509,19 @@ def python_string_to_node(raw, ref):
     Raises:
         ParseError: If unable to resolve the reference for some reason
     """
-    try:
-        module = ast.parse(raw)
-    except Exception as e:
-        raise ParseError(str(e))
+    return parsed_module_to_node(ParsedModule(raw, lazy=lazy), ref)
 
+
+def parsed_module_to_node(parsed, ref):
+    """
+    Look up a code reference in a ParsedModule
+
+    Raises:
+        ParseError: If unable to resolve the reference for some reason
+    """
     try:
-        node = find_name_in_nodes(ref, module.body)
+        symbol = parsed.lookup(ref)
     except NodeNotFound as e:
         raise ParseError(str(e))
 
-    return node
+    return symbol.node
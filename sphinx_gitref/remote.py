@@ -2,6 +2,7 @@
 Remote definitions
 """
 import re
+import string
 
 
 if hasattr(re, "Pattern"):
@@ -11,26 +12,130 @@ else:
     Pattern = re._pattern_type
 
 
+#: Patterns to find the host and repo in a remote URL, for remotes indexed by host
+URL_PATTERNS = [
+    # scp-like syntax, eg ``git@github.com:user/repo.git``
+    re.compile(r"^(?:[^@/]+@)?(?P<host>[^:/]+):(?!//)(?P<repo>.+?)(?:\.git)?/?$"),
+    # URL syntax, eg ``https://github.com/user/repo.git``
+    re.compile(
+        r"^[a-z+]+://(?:[^@/]+@)?(?P<host>[^:/]+)(?::\d+)?/(?P<repo>.+?)(?:\.git)?/?$"
+    ),
+]
+
+
+def split_url(url):
+    """
+    Return the host and repo from a remote URL, or ``(None, None)`` if not recognised
+    """
+    for pattern in URL_PATTERNS:
+        matches = pattern.match(url)
+        if matches:
+            return matches.group("host"), matches.group("repo")
+    return None, None
+
+
+class Template:
+    """
+    URL pattern compiled for a single remote
+
+    The fields which are the same for every URL, such as ``repo`` and ``branch``, are
+    substituted once, so rendering is a concatenation of the remaining fields.
+    """
+
+    #: ``(literal, field, conversion, format_spec)`` for each field left to render
+    parts = None
+
+    #: Literal text after the last field
+    tail = None
+
+    def __init__(self, pattern, **values):
+        self.parts = []
+        literal = ""
+        formatter = string.Formatter()
+        for text, field, format_spec, conversion in formatter.parse(pattern):
+            literal += text
+            if field is None:
+                continue
+            if field in values:
+                value = formatter.convert_field(values[field], conversion)
+                literal += format(value, format_spec)
+            else:
+                self.parts.append((literal, field, conversion, format_spec))
+                literal = ""
+        self.tail = literal
+
+    def render(self, **values):
+        rendered = []
+        for literal, field, conversion, format_spec in self.parts:
+            value = values[field]
+            if conversion:
+                value = string.Formatter().convert_field(value, conversion)
+            rendered.append(literal)
+            rendered.append(format(value, format_spec))
+        rendered.append(self.tail)
+        return "".join(rendered)
+
+
 class Registry:
     """
     Remote registry
+
+    Remotes which define ``hosts`` are indexed by host, and will be found for any remote
+    URL on that host. Remotes which don't, including subclasses which inherit their
+    ``hosts``, are matched using their ``remote_match``.
     """
 
     def __init__(self):
         self.remotes = []
+        self.hosts = {}
+        self.unindexed = []
 
     def register(self, cls):
         """
         Register the class
         """
         self.remotes.append(cls)
+
+        # Subclasses of indexed remotes only take over hosts they define themselves
+        hosts = cls.__dict__.get("hosts", [])
+        for host in hosts:
+            self.hosts.setdefault(host, []).append(cls)
+        if not hosts:
+            self.unindexed.append(cls)
         return cls
 
-    def get_by_url(self, url, branch):
+    def get_by_name(self, name):
+        """
+        Return the registered Remote class with the given name, case insensitive
+        """
+        for remote in reversed(self.remotes):
+            if remote.__name__.lower() == name.lower():
+                return remote
+        raise ValueError(f"Unknown remote {name}")
+
+    def get_by_url(self, url, branch, hosts=None):
         """
         Return an instantiated Remote for the given git Repo instance
+
+        Arguments:
+            url (str): The remote URL
+            branch (str): The branch or commit to link to
+            hosts (dict): Names of remotes to use for self-hosted servers, by host,
+                eg ``{"git.example.com": "gitlab"}``. These take priority over the
+                registered hosts, and only apply to this lookup.
         """
-        for remote in self.remotes:
+        overrides = {
+            override_host: self.get_by_name(name)
+            for override_host, name in (hosts or {}).items()
+        }
+
+        host, repo = split_url(url)
+        if host in overrides:
+            return overrides[host](repo, branch, host=host)
+        if host in self.hosts:
+            return self.hosts[host][0](repo, branch, host=host)
+
+        for remote in self.unindexed:
             for pattern in remote.get_remote_patterns():
                 matches = pattern.match(url)
                 if matches:
@@ -46,18 +151,25 @@ class Remote:
     Base class for remotes
     """
 
-    #: RegExp: Compiled regex pattern to match the remote url and extract the repo name.
-    #: Must contain the named group ``repo``.
+    #: list[str]: Hosts of the remote site. Remote URLs on these hosts will use this
+    #: remote, and the host will be passed to ``url_pattern`` as ``host``.
+    hosts = []
+
+    #: RegExp: Compiled regex pattern to match the remote url and extract the repo name,
+    #: for remotes without ``hosts``. Must contain the named group ``repo``.
     remote_match = None
 
     #: str: Pattern of URL to code on remote site. Will be formatted with the values
-    #: ``repo``, ``branch``, ``filename`` and ``line``
+    #: ``host``, ``repo``, ``branch``, ``filename`` and ``line``
     url_pattern = None
 
     #: Pattern for line-based URLs. If a line number is specified, this will be rendered
     #: and passed to ``url_pattern`` as ``line``, otherwise ``line`` will be empty.
     url_pattern_line = None
 
+    #: str: The host of the remote site.
+    host = None
+
     #: str: The identifying repo name on the remote site. Usually in the format
     #: ``username/repo``.
     repo = None
@@ -80,35 +192,48 @@ class Remote:
         """
         if isinstance(self.remote_match, Pattern):
             return [self.remote_match]
-        return self.remote_match
+        return self.remote_match or []
 
-    def __init__(self, repo, branch):
+    def __init__(self, repo, branch, host=None):
         """
         Arguments:
             repo (str): The identifying repo name on the remote site. Usually in the
                 format ``username/repo``.
-            branch (str): The branch to link to.
+            branch (str): The branch to link to, or the commit SHA if
+                ``gitref_link_to_commit`` is set.
+            host (str): The host of the remote site. Defaults to the first of
+                ``hosts``.
         """
         self.repo = repo
         self.branch = branch
+        self.host = host or (self.hosts[0] if self.hosts else None)
+        self.urls = {}
+
+        if self.url_pattern is not None:
+            self.template = Template(
+                self.url_pattern, host=self.host, repo=repo, branch=branch
+            )
+        if self.url_pattern_line is not None:
+            self.line_template = Template(self.url_pattern_line)
 
     def get_url(self, filename, line=None):
         """
         Return URL to file.
 
-        Renders ``url_pattern`` and ``url_pattern_line``.
+        Renders ``url_pattern`` and ``url_pattern_line``. URLs are cached, as the same
+        file and line are often linked many times.
         """
-        line_rendered = self.render_line(line)
-
-        url = self.url_pattern.format(
-            repo=self.repo, branch=self.branch, filename=filename, line=line_rendered
-        )
-        return url
+        key = (filename, line)
+        if key not in self.urls:
+            self.urls[key] = self.template.render(
+                filename=filename, line=self.render_line(line)
+            )
+        return self.urls[key]
 
     def render_line(self, line):
         if line is None:
             return ""
-        return self.url_pattern_line.format(line=line)
+        return self.line_template.render(line=line)
 
 
 class GitHub(Remote):
@@ -116,11 +241,8 @@ class GitHub(Remote):
     Repositories on https://github.com/
     """
 
-    remote_match = [
-        re.compile(r"^git@github.com:(?P<repo>.+?)(\.git)?$"),
-        re.compile(r"^https://github.com/(?P<repo>.+?)(\.git)?$"),
-    ]
-    url_pattern = "https://github.com/{repo}/blob/{branch}/{filename}{line}"
+    hosts = ["github.com"]
+    url_pattern = "https://{host}/{repo}/blob/{branch}/{filename}{line}"
     url_pattern_line = "#L{line}"
 
 
@@ -129,11 +251,8 @@ class Bitbucket(Remote):
     Repositories on https://bitbucket.org/
     """
 
-    remote_match = [
-        re.compile(r"^git@bitbucket.org:(?P<repo>.+?)(\.git)?$"),
-        re.compile(r"^https://bitbucket.org/(?P<repo>.+?)(\.git)?$"),
-    ]
-    url_pattern = "https://bitbucket.org/{repo}/src/{branch}/{filename}{line}"
+    hosts = ["bitbucket.org"]
+    url_pattern = "https://{host}/{repo}/src/{branch}/{filename}{line}"
     url_pattern_line = "#lines-{line}"
 
 
@@ -142,9 +261,16 @@ class GitLab(Remote):
     Repositories on https://gitlab.com/
     """
 
-    remote_match = [
-        re.compile(r"^git@gitlab.com:(?P<repo>.+?)(\.git)?$"),
-        re.compile(r"^https://gitlab.com/(?P<repo>.+?)(\.git)?$"),
-    ]
-    url_pattern = "https://gitlab.com/{repo}/blob/{branch}/{filename}{line}"
+    hosts = ["gitlab.com"]
+    url_pattern = "https://{host}/{repo}/blob/{branch}/{filename}{line}"
+    url_pattern_line = "#L{line}"
+
+
+class Gitea(Remote):
+    """
+    Repositories on https://gitea.com/, or self-hosted Gitea or Forgejo servers
+    """
+
+    hosts = ["gitea.com"]
+    url_pattern = "https://{host}/{repo}/src/{branch}/{filename}{line}"
     url_pattern_line = "#L{line}"
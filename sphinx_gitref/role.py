@@ -14,6 +14,16 @@ from .parser import python_to_node
 
 if TYPE_CHECKING:
     from docutils.parsers.rst.states import Inliner
+    from sphinx.application import Sphinx
+
+
+class pending_gitref(nodes.Inline, nodes.Element):
+    """
+    Placeholder for a gitref role which is resolved after all documents are read
+
+    Used when ``gitref_deferred = True``, and replaced by the ``ResolveGitrefs``
+    post-transform.
+    """
 
 
 def gitref(
@@ -44,9 +54,13 @@ def gitref(
 
     Renders HTML:
         <a href="url">label</a>
+
+    If ``gitref_deferred`` is set, the target isn't resolved until all documents have
+    been read - see ``pending_gitref``.
     """
     # Collect config vars
-    app = inliner.document.settings.env.app
+    env = inliner.document.settings.env
+    app = env.app
     try:
         remote = app.config.gitref_remote
         if not remote:
@@ -61,8 +75,40 @@ def gitref(
     title = utils.unescape(title)
     target = utils.unescape(target)
 
-    # Find the target
-    found = hasher.find_target(target)
+    if app.config.gitref_deferred:
+        # Leave it for the ResolveGitrefs post-transform, once every target is known
+        env.gitref_docs.setdefault(env.docname, {}).setdefault(target, None)
+        node = pending_gitref(
+            rawtext, reftarget=target, reftitle=title, options=options or {}
+        )
+        node.source, node.line = inliner.reporter.get_source_and_line(lineno)
+        return [node], []
+
+    # Find the target, and record it against the document in case we're running in
+    # parallel and the results need to be merged back into the main process
+    hasher.find_target(target)
+    env.gitref_docs.setdefault(env.docname, {})[target] = hasher.get_result(target)
+
+    node, error = build_reference(app, rawtext, title, target, options)
+    if error:
+        inliner.reporter.error(error)
+    return [node], []
+
+
+def build_reference(
+    app: Sphinx,
+    rawtext: str,
+    title: str,
+    target: str,
+    options: dict | None = None,
+) -> tuple[nodes.Node, str | None]:
+    """
+    Build the node for a target which has been found by the hasher
+
+    Returns the node and an error message, if the target could not be resolved
+    """
+    remote = app.config.gitref_remote
+    hasher = app.hasher
     filename, coderef = hasher.name_ref[target]
 
     # Set title if not set
@@ -75,10 +121,9 @@ def gitref(
 
     if target in hasher.errors:
         error = hasher.errors[target]
-        inliner.reporter.error(f'[gitref] Error resolving "{target}": {error}')
-        return [nodes.Text(title)], []
+        return nodes.Text(title), f'[gitref] Error resolving "{target}": {error}'
 
     ref = remote.get_url(filename=filename, line=hasher.lines.get(target))
 
     node = nodes.reference(rawtext, title, refuri=ref, **(options or {}))
-    return [node], []
+    return node, None
@@ -0,0 +1,341 @@
+"""
+Find and check gitref roles without building the documentation
+
+The scanner reads ``.rst`` and MyST ``.md`` sources line by line, looking for gitref
+roles, and checks their targets against the hash file using the same ``Hasher`` as the
+Sphinx extension. It doesn't understand every reStructuredText construct, so its results
+can be compared against a Sphinx build with ``cross_validate``.
+"""
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple
+
+from docutils import utils
+from sphinx.config import eval_config_file
+from sphinx.errors import SphinxError
+from sphinx.util.matching import get_matching_files
+from sphinx.util.nodes import split_explicit_title
+from sphinx.util.tags import Tags
+
+from .builders import create_app
+from .constants import HASH_FILENAME
+from .git import Repo
+from .setup import CONFIG_VALUES, create_hasher, get_project_root, validate_config
+
+if TYPE_CHECKING:
+    from .hasher import Hasher
+
+
+#: Role in reStructuredText - the text may contain escaped backticks
+RST_ROLE = re.compile(r":gitref:`((?:[^`\\]|\\.)+)`")
+
+#: Start of a role in reStructuredText, to find roles which continue onto the next line
+RST_ROLE_START = ":gitref:`"
+
+#: Inline literals in reStructuredText, which can contain examples of roles
+RST_INLINE_LITERAL = re.compile(r"``.+?``")
+
+#: Explicit markup in reStructuredText - a directive, target or comment
+RST_EXPLICIT = re.compile(r"^\.\.(?:\s|$)")
+
+#: Directive in reStructuredText, optionally in a substitution definition
+RST_DIRECTIVE = re.compile(r"^\.\. (?:\|[^|]+\| )?(?P<name>[\w:+-]+)::")
+
+#: Explicit markup in reStructuredText which isn't a comment
+RST_NOT_COMMENT = re.compile(r"^\.\. (?:_|\[|\|)")
+
+#: Directives whose content isn't parsed for roles
+LITERAL_DIRECTIVES = {
+    "code",
+    "code-block",
+    "sourcecode",
+    "literalinclude",
+    "doctest",
+    "testcode",
+    "testoutput",
+    "raw",
+    "math",
+}
+
+#: Role in MyST Markdown
+MYST_ROLE = re.compile(r"\{gitref\}`([^`]+)`")
+
+#: Code fence in MyST Markdown
+MYST_FENCE = re.compile(r"^ {0,3}(?P<fence>`{3,}|~{3,})(?P<info>.*)$")
+
+#: Directive in the info string of a MyST code fence
+MYST_DIRECTIVE = re.compile(r"^\{(?P<name>[^}]+)\}")
+
+#: Extensions which add MyST Markdown sources
+MYST_EXTENSIONS = {"myst_parser", "myst_nb"}
+
+
+class Reference(NamedTuple):
+    """
+    A gitref role found in a source file
+    """
+
+    path: Path
+    lineno: int
+    target: str
+
+
+def scan_rst(lines: Iterable[str]) -> Iterator[tuple[int, str]]:
+    """
+    Find gitref roles in reStructuredText, and return their line numbers and targets
+
+    Inline literals, literal blocks, comments and code directives are skipped.
+    """
+    # Indent of a literal marker - more indented lines and blank lines are skipped
+    skip_indent = None
+
+    # Line number and text of a role which hasn't been closed yet
+    pending = None
+
+    for lineno, line in enumerate(lines, 1):
+        stripped = line.strip()
+        indent = len(line) - len(line.lstrip())
+
+        if skip_indent is not None:
+            if not stripped or indent > skip_indent:
+                continue
+            skip_indent = None
+
+        if pending is None:
+            start, text = lineno, stripped
+        else:
+            start, text = pending[0], f"{pending[1]}\n{stripped}"
+
+        text = RST_INLINE_LITERAL.sub("", text)
+        for match in RST_ROLE.finditer(text):
+            has_t, title, target = split_explicit_title(utils.escape2null(match[1]))
+            yield start, utils.unescape(target)
+
+        remainder = RST_ROLE.sub("", text)
+        if stripped and RST_ROLE_START in remainder:
+            pending = (start, remainder[remainder.index(RST_ROLE_START) :])
+        else:
+            pending = None
+
+        if RST_EXPLICIT.match(stripped):
+            directive = RST_DIRECTIVE.match(stripped)
+            if directive:
+                if directive["name"] in LITERAL_DIRECTIVES:
+                    skip_indent = indent
+            elif not RST_NOT_COMMENT.match(stripped):
+                skip_indent = indent
+        elif stripped.endswith("::"):
+            skip_indent = indent
+
+
+def scan_myst(lines: Iterable[str]) -> Iterator[tuple[int, str]]:
+    """
+    Find gitref roles in MyST Markdown, and return their line numbers and targets
+
+    Comments and code fences are skipped, unless the fence is a directive whose content
+    is parsed.
+    """
+    # Open fences, as ``(fence, is_literal)``
+    fences = []
+
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip("\n")
+        fence = MYST_FENCE.match(line)
+        if fence:
+            marker, info = fence["fence"], fence["info"].strip()
+            if (
+                fences
+                and not info
+                and marker[0] == fences[-1][0][0]
+                and len(marker) >= len(fences[-1][0])
+            ):
+                fences.pop()
+                continue
+
+            if not fences or not fences[-1][1]:
+                directive = MYST_DIRECTIVE.match(info)
+                fences.append(
+                    (marker, not directive or directive["name"] in LITERAL_DIRECTIVES)
+                )
+                continue
+
+        if fences and fences[-1][1]:
+            continue
+
+        if line.lstrip().startswith("%"):
+            continue
+
+        for match in MYST_ROLE.finditer(line):
+            has_t, title, target = split_explicit_title(match[1])
+            yield lineno, utils.unescape(target)
+
+
+def find_with_sphinx(
+    confdir: Path, build_dir: Path | None = None
+) -> dict[str, set[str]]:
+    """
+    Build the documentation with the null builder, and return the targets found in
+    each document
+
+    Build output is discarded; errors will have been reported by the scanner.
+    """
+    app = create_app(confdir, build_dir=build_dir)
+    try:
+        app.build()
+    except (SphinxError, ValueError):
+        pass
+    return {docname: set(results) for docname, results in app.env.gitref_docs.items()}
+
+
+def scan_file(path: Path) -> list[Reference]:
+    """
+    Find the gitref roles in a source file
+    """
+    scan = scan_myst if path.suffix == ".md" else scan_rst
+    with path.open(encoding="utf-8-sig") as file:
+        return [Reference(path, lineno, target) for lineno, target in scan(file)]
+
+
+class Scanner:
+    """
+    Find and check gitref roles in a Sphinx project without building it
+    """
+
+    #: Path to the dir containing ``conf.py``, which is also the source dir
+    confdir: Path
+
+    #: Config values, with defaults for any not in ``conf.py``
+    config: SimpleNamespace
+
+    #: Hasher used to check the references
+    hasher: Hasher
+
+    #: References found in each document
+    references: dict[str, list[Reference]]
+
+    def __init__(self, confdir: Path, overrides: dict | None = None):
+        self.confdir = confdir
+        namespace = eval_config_file(str(confdir / "conf.py"), Tags())
+        namespace.update(overrides or {})
+
+        values = {"source_suffix": ".rst", "exclude_patterns": [], "extensions": []}
+        values.update({name: default for name, default, rebuild in CONFIG_VALUES})
+        self.config = SimpleNamespace(
+            **{name: namespace.get(name, default) for name, default in values.items()}
+        )
+        self.references = {}
+
+    @property
+    def suffixes(self) -> list[str]:
+        """
+        Suffixes of source files
+        """
+        suffixes = self.config.source_suffix
+        suffixes = [suffixes] if isinstance(suffixes, str) else list(suffixes)
+        if MYST_EXTENSIONS & set(self.config.extensions) and ".md" not in suffixes:
+            suffixes.append(".md")
+        return suffixes
+
+    def find_sources(self) -> dict[str, Path]:
+        """
+        Find the source files of the documents, by docname
+        """
+        excluded = list(self.config.exclude_patterns) + ["_build", "**/.*"]
+        sources = {}
+        for filename in get_matching_files(self.confdir, exclude_patterns=excluded):
+            for suffix in self.suffixes:
+                if filename.endswith(suffix):
+                    sources[filename[: -len(suffix)]] = self.confdir / filename
+                    break
+        return sources
+
+    def scan(self) -> dict[str, list[Reference]]:
+        """
+        Find the references in every document
+        """
+        self.references = {
+            docname: scan_file(path)
+            for docname, path in sorted(self.find_sources().items())
+        }
+        return self.references
+
+    def check(self) -> list[str]:
+        """
+        Scan the documents and check their references against the hash file
+
+        Returns a list of error messages, in the same format as Sphinx
+        """
+        self.prepare()
+        self.scan()
+        return self.verify()
+
+    def prepare(self):
+        """
+        Create the hasher, and check the hash file against the code
+        """
+        config = self.config
+        validate_config(config)
+        hash_path = self.confdir / HASH_FILENAME
+        if not hash_path.exists():
+            raise ValueError("Could not load gitref hash - run with --gitref-update?")
+
+        project_root = get_project_root(
+            self.confdir, config.gitref_relative_project_root
+        )
+        config.gitref_hashing = True
+        config.gitref_updating = False
+        self.hasher = create_hasher(
+            config, hash_path, project_root, Repo(project_root / ".git")
+        )
+        self.hasher.check()
+
+    def verify(self) -> list[str]:
+        """
+        Check the scanned references, and return error messages for any which failed
+        """
+        hasher = self.hasher
+        references = [ref for refs in self.references.values() for ref in refs]
+        hasher.used = set()
+        hasher.find_targets(ref.target for ref in references)
+        hasher.symbols.save()
+
+        return [
+            f"{ref.path}:{ref.lineno}: ERROR: [gitref] Error resolving"
+            f' "{ref.target}": {hasher.errors[ref.target]}'
+            for ref in references
+            if ref.target in hasher.errors
+        ]
+
+    @property
+    def unused(self) -> set[str]:
+        """
+        Targets in the hash file which weren't found in the documents
+        """
+        return set(self.hasher.hashes) - self.hasher.used
+
+    def cross_validate(self, found: dict[str, Iterable[str]]) -> list[str]:
+        """
+        Compare the targets scanned in each document with those found by Sphinx
+
+        Returns a list of differences
+        """
+        scanned = {
+            docname: {ref.target for ref in refs}
+            for docname, refs in self.references.items()
+        }
+        differences = []
+        for docname in sorted(set(scanned) | set(found)):
+            ours = scanned.get(docname, set())
+            theirs = set(found.get(docname, ()))
+            differences.extend(
+                f"{docname}: {target} only found by the scanner"
+                for target in sorted(ours - theirs)
+            )
+            differences.extend(
+                f"{docname}: {target} only found by Sphinx"
+                for target in sorted(theirs - ours)
+            )
+        return differences
@@ -6,11 +6,47 @@ The ``setup()`` function will be called automatically by Sphinx
 from pathlib import Path
 
 from .builders import NullBuilder
-from .constants import DEFAULT_LABEL_FORMAT, HASH_FILENAME
+from .constants import (
+    CACHE_FILENAME,
+    DEFAULT_HASH_MODE,
+    DEFAULT_IGNORE_PATTERNS,
+    DEFAULT_LABEL_FORMAT,
+    DEFAULT_MODULE_CACHE_SIZE,
+    DEFAULT_STREAM_THRESHOLD,
+    HASH_FILENAME,
+    HASH_MODES,
+    PARSE_MODES,
+)
 from .git import Repo
 from .hasher import Hasher
 from .remote import registry
 from .role import gitref
+from .transforms import ResolveGitrefs
+
+
+#: Config values, as ``(name, default, rebuild)``
+CONFIG_VALUES = [
+    ("gitref_relative_project_root", None, "html"),
+    ("gitref_remote_url", None, "html"),
+    ("gitref_branch", None, "html"),
+    ("gitref_remotes", {}, "html"),
+    ("gitref_label_format", DEFAULT_LABEL_FORMAT, "html"),
+    ("gitref_hashing", True, "env"),
+    ("gitref_updating", False, ""),
+    ("gitref_module_cache_size", DEFAULT_MODULE_CACHE_SIZE, ""),
+    ("gitref_symbol_cache", True, ""),
+    ("gitref_parse_mode", "full", ""),
+    ("gitref_hash_mode", DEFAULT_HASH_MODE, ""),
+    ("gitref_stream_threshold", DEFAULT_STREAM_THRESHOLD, ""),
+    ("gitref_ignore_patterns", DEFAULT_IGNORE_PATTERNS, ""),
+    ("gitref_git_index", False, ""),
+    ("gitref_paranoid", False, ""),
+    ("gitref_workers", None, ""),
+    ("gitref_deferred", False, "env"),
+    ("gitref_changed_only", False, ""),
+    ("gitref_prune", False, ""),
+    ("gitref_link_to_commit", False, "env"),
+]
 
 
 def get_project_root(doc_root: Path, option: str | None):
@@ -27,7 +63,8 @@ def get_project_root(doc_root: Path, option: str | None):
     # Try to detect it
     project_root = doc_root
     while project_root != project_root.parent:
-        if (project_root / ".git").is_dir():
+        # .git is a file in worktrees and submodules
+        if (project_root / ".git").exists():
             return project_root
         project_root = project_root.parent
 
@@ -48,6 +85,7 @@ def complete_config(app):
         conf_dir, app.config.gitref_relative_project_root
     )
     repo = Repo(app.env.project_root / ".git")
+    app.gitref_repo = repo
 
     # Update config with defaults from the repo
     if app.config.gitref_remote_url is None:
@@ -68,27 +106,77 @@ def lookup_remote(app):
     except AttributeError:
         raise ValueError("Could not determine gitref_remote_url, must set explicitly")
 
-    try:
-        branch = config.gitref_branch
+    # Link to the current commit instead of the branch, so line numbers stay correct
+    if config.gitref_link_to_commit:
+        branch = app.gitref_repo.get_head_commit()
         if not branch:
-            raise AttributeError
-    except AttributeError:
-        raise ValueError("Could not determine gitref_branch, must set explicitly")
+            raise ValueError(
+                "Could not determine the current commit for gitref_link_to_commit"
+            )
+    else:
+        try:
+            branch = config.gitref_branch
+            if not branch:
+                raise AttributeError
+        except AttributeError:
+            raise ValueError("Could not determine gitref_branch, must set explicitly")
+
+    config.gitref_remote = registry.get_by_url(
+        remote_url, branch, hosts=config.gitref_remotes
+    )
+
+
+def validate_config(config):
+    """
+    Check config values which can't be checked by type
+    """
+    if config.gitref_parse_mode not in PARSE_MODES:
+        raise ValueError(
+            f"Unknown gitref_parse_mode {config.gitref_parse_mode!r}"
+            f" - must be one of {', '.join(PARSE_MODES)}"
+        )
+    if config.gitref_hash_mode not in HASH_MODES:
+        raise ValueError(
+            f"Unknown gitref_hash_mode {config.gitref_hash_mode!r}"
+            f" - must be one of {', '.join(HASH_MODES)}"
+        )
+
 
-    config.gitref_remote = registry.get_by_url(remote_url, branch)
+def create_hasher(config, hash_path: Path, project_root: Path, repo: Repo) -> Hasher:
+    """
+    Create a Hasher from the config values
+    """
+    return Hasher(
+        file=hash_path,
+        project_root=project_root,
+        hashing=config.gitref_hashing,
+        updating=config.gitref_updating,
+        module_cache_size=config.gitref_module_cache_size,
+        cache_file=(
+            hash_path.parent / CACHE_FILENAME if config.gitref_symbol_cache else None
+        ),
+        lazy_parsing=config.gitref_parse_mode == "lazy",
+        hash_mode=config.gitref_hash_mode,
+        stream_threshold=config.gitref_stream_threshold,
+        ignore_patterns=config.gitref_ignore_patterns,
+        repo=repo,
+        use_git_index=config.gitref_git_index,
+        paranoid=config.gitref_paranoid,
+        workers=config.gitref_workers,
+        changed_only=config.gitref_changed_only,
+        prune=config.gitref_prune,
+    )
 
 
 def prepare_hasher(app):
     hashing = app.config.gitref_hashing
     updating = app.config.gitref_updating
+    validate_config(app.config)
     if hashing and not updating and not app.env.hash_path.exists():
         raise ValueError("Could not load gitref hash - run with --gitref-update?")
 
-    app.hasher = Hasher(
-        file=app.env.hash_path,
-        project_root=app.env.project_root,
-        hashing=hashing,
-        updating=updating,
+    app.hasher = create_hasher(
+        app.config, app.env.hash_path, app.env.project_root, app.gitref_repo
     )
 
     if not updating:
@@ -96,19 +184,103 @@ def prepare_hasher(app):
 
 
 def handle_builder_inited(app):
+    # Results of gitref roles in each document, as ``{docname: {target: result}}``
+    if not hasattr(app.env, "gitref_docs"):
+        app.env.gitref_docs = {}
+
+    # Commit which links were rendered with, if gitref_link_to_commit is set
+    if not hasattr(app.env, "gitref_linked_commit"):
+        app.env.gitref_linked_commit = None
+
     complete_config(app)
     lookup_remote(app)
     prepare_hasher(app)
 
 
+def handle_env_purge_doc(app, env, docname):
+    env.gitref_docs.pop(docname, None)
+
+
+def handle_env_merge_info(app, env, docnames, other):
+    """
+    Collect the results of documents read by a parallel worker
+    """
+    for docname in docnames:
+        if docname in other.gitref_docs:
+            results = other.gitref_docs[docname]
+            env.gitref_docs[docname] = results
+            app.hasher.merge_results(results)
+
+
+def handle_env_updated(app, env):
+    """
+    Resolve deferred targets from every document in one batch, grouped by file
+    """
+    if app.config.gitref_link_to_commit:
+        env.gitref_linked_commit = app.config.gitref_remote.branch
+
+    pending = {
+        target
+        for results in env.gitref_docs.values()
+        for target, result in results.items()
+        if result is None
+    }
+    if not pending:
+        return
+
+    app.hasher.find_targets(pending)
+    for results in env.gitref_docs.values():
+        for target, result in results.items():
+            if result is None:
+                results[target] = app.hasher.get_result(target)
+
+
+def is_outdated(hasher, target, result):
+    """
+    Check if a target in a document which hasn't changed needs to be resolved again
+
+    When updating, that's if its file has changed. When checking, it's if it has
+    failed, or failed last time, so that the error is reported against the document.
+    """
+    if hasher.updating:
+        return not hasher.is_current(target)
+
+    return (
+        target in hasher.errors
+        or target not in hasher.hashes
+        or (result is not None and result[2] is not None)
+    )
+
+
 def handle_get_outdated(app, env, added, changed, removed):
-    if app.config.gitref_updating:
-        # If updating, mark all documents as outdated
-        return env.found_docs
-    return added | changed | removed
+    """
+    Read documents again if any of their targets need to be resolved again, or if their
+    links need to point to a new commit
+    """
+    if (
+        app.config.gitref_link_to_commit
+        and env.gitref_linked_commit != app.config.gitref_remote.branch
+    ):
+        return [docname for docname in env.gitref_docs if docname in env.found_docs]
+
+    if not app.hasher.hashing:
+        return []
+
+    return [
+        docname
+        for docname, results in env.gitref_docs.items()
+        if docname in env.found_docs
+        and any(
+            is_outdated(app.hasher, target, result)
+            for target, result in results.items()
+        )
+    ]
 
 
 def handle_build_finished(app, exception):
+    # Include targets from documents which weren't read in this build
+    for results in app.env.gitref_docs.values():
+        app.hasher.used.update(results)
     app.hasher.finish()
 
 
@@ -119,16 +291,15 @@ def setup(app):
     from . import __version__
 
     # Add config variables, defaults come later
-    app.add_config_value("gitref_relative_project_root", default=None, rebuild="html")
-    app.add_config_value("gitref_remote_url", None, "html")
-    app.add_config_value("gitref_branch", None, "html")
-    app.add_config_value("gitref_label_format", DEFAULT_LABEL_FORMAT, "html")
-    app.add_config_value("gitref_hashing", default=True, rebuild="env")
-    app.add_config_value("gitref_updating", default=False, rebuild="env")
+    for name, default, rebuild in CONFIG_VALUES:
+        app.add_config_value(name, default=default, rebuild=rebuild)
 
     # Listen for hooks
     app.connect("builder-inited", handle_builder_inited)
     app.connect("env-get-outdated", handle_get_outdated)
+    app.connect("env-purge-doc", handle_env_purge_doc)
+    app.connect("env-merge-info", handle_env_merge_info)
+    app.connect("env-updated", handle_env_updated)
     app.connect("build-finished", handle_build_finished)
 
     # Add builder
@@ -136,9 +307,11 @@ def setup(app):
 
     # Register role
     app.add_role("gitref", gitref)
+    app.add_post_transform(ResolveGitrefs)
 
     return {
         "version": __version__,
+        "env_version": 1,
         "parallel_read_safe": True,
         "parallel_write_safe": True,
     }
@@ -0,0 +1,43 @@
+"""
+Sphinx transforms
+"""
+from __future__ import annotations
+
+from sphinx.transforms.post_transforms import SphinxPostTransform
+from sphinx.util.logging import getLogger
+
+from .role import build_reference, pending_gitref
+
+logger = getLogger("sphinx_gitref")
+
+
+class ResolveGitrefs(SphinxPostTransform):
+    """
+    Replace ``pending_gitref`` nodes with links
+
+    Targets are normally resolved in a single batch once all documents have been read,
+    by ``setup.handle_env_updated``; any which weren't, such as those in documents
+    which weren't read during this build, are resolved here together.
+    """
+
+    default_priority = 5
+
+    def run(self, **kwargs):
+        pending = list(self.document.findall(pending_gitref))
+        if not pending:
+            return
+
+        hasher = self.app.hasher
+        hasher.find_targets(node["reftarget"] for node in pending)
+
+        for node in pending:
+            new_node, error = build_reference(
+                self.app,
+                node.rawsource,
+                node["reftitle"],
+                node["reftarget"],
+                node["options"],
+            )
+            if error:
+                logger.error(error, location=node)
+            node.replace_self(new_node)
@@ -0,0 +1,176 @@
+"""
+Watch the documentation and code for changes, and check references as they change
+
+The scanner and its hasher are kept between checks, so parsed modules, symbols and the
+hash file stay in memory. Files are polled for changes to their stat signatures, and
+only the references to changed files are checked again.
+"""
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from .hasher import walk_dir
+from .scanner import Scanner, scan_file
+
+#: Stat signature used to detect changes - see ``get_signature``
+Signature = Optional[tuple]
+
+
+def get_signature(path: Path, ignore_patterns: list[str]) -> Signature:
+    """
+    Return a signature which changes when a file or anything in a directory changes
+
+    Unlike ``cache.get_stat_signature``, recently modified files are not treated
+    differently, as any change to the signature will be picked up by the next poll.
+    """
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+
+    if not path.is_dir():
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    return tuple(
+        (name, get_signature(Path(filepath), ignore_patterns))
+        for name, filepath in walk_dir(path, ignore_patterns)
+    )
+
+
+class Watcher:
+    """
+    Check references whenever the documentation or referenced code changes
+    """
+
+    #: Scanner used to find and check references
+    scanner: Scanner
+
+    #: Seconds between polls
+    interval: float
+
+    #: Function to output a line
+    echo: Callable[[str], None]
+
+    #: Signatures of document sources, by docname
+    sources: dict[str, Signature]
+
+    #: Signatures of referenced files, by filename relative to the project root
+    targets: dict[str, Signature]
+
+    #: Signature of the hash file
+    hash_file: Signature
+
+    def __init__(
+        self,
+        scanner: Scanner,
+        interval: float = 0.25,
+        echo: Callable[[str], None] = print,
+    ):
+        self.scanner = scanner
+        self.interval = interval
+        self.echo = echo
+        self.sources = {}
+        self.targets = {}
+        self.hash_file = None
+
+    def run(self):
+        """
+        Check everything, then check again after every change until interrupted
+        """
+        self.report(self.scanner.check())
+        self.snapshot()
+        while True:
+            time.sleep(self.interval)
+            errors = self.poll()
+            if errors is not None:
+                self.report(errors)
+
+    def snapshot(self):
+        """
+        Record the signatures of the sources, referenced files and hash file
+        """
+        hasher = self.scanner.hasher
+        self.hash_file = get_signature(hasher.file, [])
+        self.sources = {
+            docname: get_signature(path, [])
+            for docname, path in self.scanner.find_sources().items()
+        }
+        self.targets = {
+            filename: self.get_target_signature(filename)
+            for filename in self.get_target_filenames()
+        }
+
+    def get_target_filenames(self) -> set[str]:
+        hasher = self.scanner.hasher
+        return {
+            hasher.split_target(ref.target)[0]
+            for refs in self.scanner.references.values()
+            for ref in refs
+        }
+
+    def get_target_signature(self, filename: str) -> Signature:
+        hasher = self.scanner.hasher
+        return get_signature(hasher.project_root / filename, hasher.ignore_patterns)
+
+    def poll(self) -> list[str] | None:
+        """
+        Look for changes, and check the references they affect
+
+        Returns the errors for all references, or None if nothing has changed
+        """
+        scanner = self.scanner
+        hasher = scanner.hasher
+
+        # If the hash file has been updated, start again with a new hasher, but keep
+        # the parsed modules
+        if get_signature(hasher.file, []) != self.hash_file:
+            modules = hasher.modules
+            scanner.prepare()
+            scanner.hasher.modules = modules
+            errors = scanner.verify()
+            self.snapshot()
+            return errors
+
+        changed = False
+
+        # Scan documents which have been added or changed, and forget removed ones
+        sources = scanner.find_sources()
+        for docname in set(scanner.references) - set(sources):
+            del scanner.references[docname]
+            self.sources.pop(docname, None)
+            changed = True
+
+        for docname, path in sources.items():
+            signature = get_signature(path, [])
+            if self.sources.get(docname) != signature:
+                self.sources[docname] = signature
+                scanner.references[docname] = scan_file(path)
+                changed = True
+
+        # Forget results for referenced files which have changed
+        for filename in self.get_target_filenames():
+            signature = self.get_target_signature(filename)
+            if filename not in self.targets or self.targets[filename] != signature:
+                self.targets[filename] = signature
+                hasher.forget(filename)
+                changed = True
+
+        if not changed:
+            return None
+        return scanner.verify()
+
+    def report(self, errors: list[str]):
+        """
+        Output the results of a check
+        """
+        for error in errors:
+            self.echo(error)
+
+        num = len(self.scanner.hasher.used)
+        references = "reference" if num == 1 else "references"
+        self.echo(
+            f"[{time.strftime('%H:%M:%S')}] {num} gitref {references} checked,"
+            f" {len(errors)} failed"
+        )
@@ -10,3 +10,57 @@ GIT_CONFIG = """[core]
         remote = origin
         merge = refs/heads/master
 """
+
+
+def backdate(*paths):
+    """
+    Set the mtime of files into the past so their stat signatures can be trusted
+    """
+    import os
+    import time
+
+    past = time.time_ns() - 10 * 10**9
+    for path in paths:
+        os.utime(path, ns=(past, past))
+
+
+def git_add(root, *filenames, index_version=2):
+    """
+    Create a real git repo in root and stage the given files
+
+    Files are backdated so the index doesn't consider them racily clean.
+    """
+    import subprocess
+
+    backdate(*(root / filename for filename in filenames))
+
+    def git(*args):
+        subprocess.run(["git", *args], cwd=root, check=True, capture_output=True)
+
+    if not (root / ".git" / "HEAD").exists():
+        git("init", "-q")
+    git("add", *filenames)
+    git("update-index", "--index-version", str(index_version))
+
+
+def git_commit(root, *filenames):
+    """
+    Stage the given files in a real git repo in root and commit them
+
+    Returns the new commit's SHA
+    """
+    import subprocess
+
+    git_add(root, *filenames)
+
+    def git(*args):
+        return subprocess.run(
+            ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+            cwd=root,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    git("commit", "-q", "-m", "commit")
+    return git("rev-parse", "HEAD")
@@ -0,0 +1,75 @@
+"""
+Fixtures shared between test modules
+"""
+import pytest
+
+from .common import GIT_CONFIG
+
+
+@pytest.fixture
+def paths(tmp_path):
+    class paths:
+        root = tmp_path
+
+        # Docs
+        docs = tmp_path / "docs"
+        build = tmp_path / "docs" / "_build"
+        html = tmp_path / "docs" / "_build" / "html"
+        doctrees = tmp_path / "docs" / "_build" / "doctrees"
+        conf = tmp_path / "docs" / "conf.py"
+
+        # Git
+        git = tmp_path / ".git"
+        git_config = tmp_path / ".git" / "config"
+        git_head = tmp_path / ".git" / "HEAD"
+
+        # Code
+        example = tmp_path / "example.py"
+
+    paths.docs.mkdir()
+    paths.build.mkdir()
+    paths.html.mkdir()
+    paths.doctrees.mkdir()
+    paths.conf.write_text(
+        """
+master_doc = 'index'
+extensions = ["sphinx_gitref"]
+gitref_hashing = False
+"""
+    )
+
+    paths.git.mkdir()
+    paths.git_config.write_text(GIT_CONFIG)
+    paths.git_head.write_text("ref: refs/heads/master\n")
+
+    # Give a sensible default for most tests
+    paths.example.write_text("value = 1")
+
+    return paths
+
+
+@pytest.fixture
+def extra_paths(paths):
+    paths.conf.write_text(
+        """
+master_doc = 'index'
+extensions = ["sphinx_gitref"]
+gitref_hashing = True
+"""
+    )
+
+    paths.makefile = paths.docs / "Makefile"
+    paths.makefile.write_text(
+        """SPHINXOPTS    ?=
+SPHINXBUILD   ?= sphinx-build
+SOURCEDIR     = .
+BUILDDIR      = _build
+.PHONY: help Makefile
+%: Makefile
+	@$(SPHINXBUILD) -M $@ "$(SOURCEDIR)" "$(BUILDDIR)" $(SPHINXOPTS) $(O)
+"""
+    )
+
+    paths.index = paths.docs / "index.rst"
+    paths.index.write_text("foo :gitref:`Example <example.py>`")
+    return paths
@@ -0,0 +1,43 @@
+"""
+Test the benchmark suite runs and detects regressions
+"""
+import pytest
+
+from benchmarks.corpus import Spec
+from benchmarks.runner import compare, run
+from benchmarks.suites import BENCHMARKS
+
+
+def make_results(**timings):
+    return {
+        "spec": Spec()._asdict(),
+        "benchmarks": {name: {"min": value} for name, value in timings.items()},
+    }
+
+
+def test_run__small_corpus__all_benchmarks_timed():
+    spec = Spec(files=2, functions=2, depth=2, references=10, per_doc=5)
+    results = run(spec, repeat=1)
+    assert results["spec"]["files"] == 2
+    assert results["benchmarks"].keys() == BENCHMARKS.keys()
+    assert all(timing["min"] > 0 for timing in results["benchmarks"].values())
+
+
+def test_run__unknown_benchmark__raises_error():
+    with pytest.raises(ValueError, match="Unknown benchmarks: missing"):
+        run(Spec(), ["missing"])
+
+
+def test_compare__slower_than_tolerance__regression():
+    results = make_results(check=1.3, build=1.1, new=5)
+    baseline = make_results(check=1.0, build=1.0)
+    assert compare(results, baseline, tolerance=0.2) == [
+        "check: 1.3000s, baseline 1.0000s (+30%)"
+    ]
+
+
+def test_compare__different_corpus__raises_error():
+    baseline = make_results(check=1.0)
+    baseline["spec"]["files"] += 1
+    with pytest.raises(ValueError, match="different corpus"):
+        compare(make_results(check=1.0), baseline)
@@ -0,0 +1,80 @@
+"""
+Test sphinx_gitref.cache
+"""
+import os
+
+from sphinx_gitref.cache import SymbolCache
+from sphinx_gitref.hasher import Hasher
+
+
+def test_symbol_cache__saved__loaded_by_next_build(tmp_path):
+    cache_file = tmp_path / "gitref.cache.json"
+    example = tmp_path / "example.py"
+    example.write_text("a = 1")
+
+    cache = SymbolCache(cache_file)
+    cache.set("example.py", example, "a", 1, 1, "abc")
+    cache.save()
+
+    cache = SymbolCache(cache_file)
+    assert cache.get("example.py", example, "a") == [1, 1, "abc"]
+
+
+def test_symbol_cache__file_changed__entry_discarded(tmp_path):
+    cache_file = tmp_path / "gitref.cache.json"
+    example = tmp_path / "example.py"
+    example.write_text("a = 1")
+
+    cache = SymbolCache(cache_file)
+    cache.set("example.py", example, "a", 1, 1, "abc")
+    cache.save()
+
+    example.write_text("a = 22")
+    cache = SymbolCache(cache_file)
+    assert cache.get("example.py", example, "a") is None
+
+
+def test_symbol_cache__file_touched__entry_kept(tmp_path):
+    cache_file = tmp_path / "gitref.cache.json"
+    example = tmp_path / "example.py"
+    example.write_text("a = 1")
+
+    cache = SymbolCache(cache_file)
+    cache.set("example.py", example, "a", 1, 1, "abc")
+    cache.save()
+
+    stat = example.stat()
+    os.utime(example, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    cache = SymbolCache(cache_file)
+    assert cache.get("example.py", example, "a") == [1, 1, "abc"]
+
+
+def test_symbol_cache__invalid_file__ignored(tmp_path):
+    cache_file = tmp_path / "gitref.cache.json"
+    cache_file.write_text("invalid")
+    cache = SymbolCache(cache_file)
+    assert cache.entries == {}
+
+
+def test_hasher__cached_symbols__file_not_parsed(tmp_path):
+    cache_file = tmp_path / "gitref.cache.json"
+    (tmp_path / "example.py").write_text("a = 1\nb = 2\n")
+
+    def build():
+        hasher = Hasher(
+            file=tmp_path / "gitref.json",
+            project_root=tmp_path,
+            hashing=False,
+            updating=False,
+            cache_file=cache_file,
+        )
+        hasher.find_target("example.py::b")
+        hasher.symbols.save()
+        return hasher
+
+    first = build()
+    second = build()
+    assert first.modules.misses == 1
+    assert second.modules.misses == 0
+    assert second.lines["example.py::b"] == 2
+    assert second.hashes["example.py::b"] == first.hashes["example.py::b"]
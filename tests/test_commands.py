@@ -1,52 +1,9 @@
-import os
-from pathlib import Path
-
-import pytest
 from click.testing import CliRunner
 from sphinx.application import Sphinx
 from sphinx.errors import SphinxError
 
-import sphinx_gitref
 from sphinx_gitref.commands import cli
 
-from .test_role import paths  # noqa
-
-
-@pytest.fixture
-def with_pythonpath():
-    gitref_path = Path(sphinx_gitref.__file__).parent.parent.absolute()
-    orig = os.environ.get("PYTHONPATH", "")
-    os.environ["PYTHONPATH"] = f"{orig}:{gitref_path}" if orig else str(gitref_path)
-    yield
-    os.environ["PYTHONPATH"] = orig
-
-
-@pytest.fixture
-def extra_paths(with_pythonpath, paths):
-    paths.conf.write_text(
-        """
-master_doc = 'index'
-extensions = ["sphinx_gitref"]
-gitref_hashing = True
-"""
-    )
-
-    paths.makefile = paths.docs / "Makefile"
-    paths.makefile.write_text(
-        """SPHINXOPTS    ?=
-SPHINXBUILD   ?= sphinx-build
-SOURCEDIR     = .
-BUILDDIR      = _build
-.PHONY: help Makefile
-%: Makefile
-	@$(SPHINXBUILD) -M $@ "$(SOURCEDIR)" "$(BUILDDIR)" $(SPHINXOPTS) $(O)
-"""
-    )
-
-    paths.index = paths.docs / "index.rst"
-    paths.index.write_text("foo :gitref:`Example <example.py>`")
-    return paths
-
 
 def test_check__no_hashfile__exception(extra_paths):
     runner = CliRunner()
@@ -84,3 +41,130 @@ def test_update_change_check__hash_changed__exception(extra_paths):
     assert '[gitref] Error resolving "example.py": Target changed' in result.output
     assert "[gitref] References failed. Build failed." in result.output
     assert result.exit_code == 1
+
+
+def test_update_check__paranoid__runs(extra_paths):
+    runner = CliRunner()
+    runner.invoke(cli, ["update", str(extra_paths.docs)])
+    result = runner.invoke(cli, ["check", "--paranoid", str(extra_paths.docs)])
+    assert "1 gitref reference found" in result.output
+    assert result.exit_code == 0
+
+
+def test_update__prune__runs(extra_paths):
+    runner = CliRunner()
+    result = runner.invoke(cli, ["update", "--prune", str(extra_paths.docs)])
+    assert result.exit_code == 0
+    assert '"example.py"' in (extra_paths.docs / "gitref.json").read_text()
+
+
+def test_update_check__scan__runs(extra_paths):
+    runner = CliRunner()
+    runner.invoke(cli, ["update", str(extra_paths.docs)])
+    result = runner.invoke(cli, ["check", "--scan", str(extra_paths.docs)])
+    assert "1 gitref reference found" in result.output
+    assert result.exit_code == 0
+
+
+def test_update_change_check__scan__hash_changed__exception(extra_paths):
+    runner = CliRunner()
+    runner.invoke(cli, ["update", str(extra_paths.docs)])
+    extra_paths.example.write_text("value = 2")
+
+    result = runner.invoke(cli, ["check", "--scan", str(extra_paths.docs)])
+    assert (
+        f'{extra_paths.index}:1: ERROR: [gitref] Error resolving "example.py":'
+        " Target changed"
+    ) in result.output
+    assert result.exit_code == 1
+
+
+def test_update_check__cross_validate__differences_reported(extra_paths):
+    runner = CliRunner()
+    runner.invoke(cli, ["update", str(extra_paths.docs)])
+    result = runner.invoke(cli, ["check", "--cross-validate", str(extra_paths.docs)])
+    assert result.exit_code == 0
+
+    # The scanner doesn't follow includes
+    (extra_paths.docs / "snippet.txt").write_text(":gitref:`example.py`\n")
+    extra_paths.index.write_text(".. include:: snippet.txt\n")
+    result = runner.invoke(cli, ["check", "--cross-validate", str(extra_paths.docs)])
+    assert "index: example.py only found by Sphinx" in result.output
+    assert result.exit_code == 1
+
+
+def test_update_check__no_makefile__runs(extra_paths):
+    extra_paths.makefile.unlink()
+    runner = CliRunner()
+    runner.invoke(cli, ["update", str(extra_paths.docs)])
+    result = runner.invoke(cli, ["check", str(extra_paths.docs)])
+    assert "1 gitref reference found" in result.output
+    assert result.exit_code == 0
+
+
+def test_update_check__jobs__runs(extra_paths):
+    runner = CliRunner()
+    result = runner.invoke(cli, ["update", "--jobs", "2", str(extra_paths.docs)])
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ["check", "-j", "auto", str(extra_paths.docs)])
+    assert "1 gitref reference found" in result.output
+    assert result.exit_code == 0
+
+
+def test_check__jobs_invalid__usage_error(extra_paths):
+    runner = CliRunner()
+    result = runner.invoke(cli, ["check", "--jobs", "none", str(extra_paths.docs)])
+    assert "must be a number or 'auto'" in result.output
+    assert result.exit_code == 2
+
+
+def make_split_layout(project, source="source", makefile=None):
+    """
+    Move the docs into a source dir, as sphinx-quickstart does with separate source
+    and build dirs
+    """
+    source_dir = project.docs / source
+    source_dir.mkdir()
+    (source_dir / "conf.py").write_text(
+        "master_doc = 'index'\nextensions = ['sphinx_gitref']\n"
+    )
+    (source_dir / "index.rst").write_text("foo :gitref:`Example <example.py>`")
+    project.conf.unlink()
+    if makefile:
+        (project.docs / "Makefile").write_text(makefile)
+    return source_dir
+
+
+def test_update_check__source_dir__runs(paths):
+    source = make_split_layout(paths)
+    runner = CliRunner()
+    result = runner.invoke(cli, ["update", str(paths.docs)])
+    assert result.exit_code == 0
+    assert (source / "gitref.json").exists()
+    assert (paths.docs / "build" / "doctrees").is_dir()
+
+    result = runner.invoke(cli, ["check", str(paths.docs)])
+    assert "build succeeded" in result.output
+    assert result.exit_code == 0
+
+
+def test_update_check__makefile_dirs__used(paths):
+    source = make_split_layout(
+        paths, "src", makefile="SOURCEDIR     = src\nBUILDDIR      = out\n"
+    )
+    runner = CliRunner()
+    result = runner.invoke(cli, ["update", str(paths.docs)])
+    assert result.exit_code == 0
+    assert (source / "gitref.json").exists()
+    assert (paths.docs / "out" / "doctrees").is_dir()
+
+    result = runner.invoke(cli, ["check", "--scan", str(paths.docs)])
+    assert "1 gitref reference found" in result.output
+    assert result.exit_code == 0
+
+
+def test_check__no_conf__error(paths):
+    paths.conf.unlink()
+    result = CliRunner().invoke(cli, ["check", str(paths.docs)])
+    assert f"No conf.py found at {paths.docs}" in result.output
+    assert result.exit_code == 2
@@ -1,11 +1,14 @@
 """
 Check local repo management
 """
+import shutil
+import subprocess
+
 import pytest
 
-from sphinx_gitref.git import Repo
+from sphinx_gitref.git import RefStore, Repo, get_ref_store
 
-from .common import GIT_CONFIG
+from .common import GIT_CONFIG, git_add, git_commit
 
 
 @pytest.fixture()
@@ -136,3 +139,239 @@ def test_head_detached__packed_ref_exists__returns_branch_name(paths):
     )
     repo = Repo(paths.git)
     assert repo.get_local_branch() == "master"
+
+
+def test_head_commit__loose_ref__returns_commit(paths):
+    paths.head.write_text("ref: refs/heads/master\n")
+    (paths.git / "refs" / "heads").mkdir(parents=True)
+    (paths.git / "refs" / "heads" / "master").write_text("1234567890abcdef\n")
+    assert Repo(paths.git).get_head_commit() == "1234567890abcdef"
+
+
+def test_head_commit__packed_ref__returns_commit(paths):
+    paths.head.write_text("ref: refs/heads/master\n")
+    paths.packed_refs.write_text(
+        """# comment
+11111 refs/heads/develop
+1234567890abcdef refs/heads/master
+^55555
+"""
+    )
+    assert Repo(paths.git).get_head_commit() == "1234567890abcdef"
+
+
+def test_head_commit__detached__returns_commit(paths):
+    paths.head.write_text("1234567890abcdef\n")
+    assert Repo(paths.git).get_head_commit() == "1234567890abcdef"
+
+
+def test_head_commit__unborn_branch__returns_none(paths):
+    paths.head.write_text("ref: refs/heads/master\n")
+    assert Repo(paths.git).get_head_commit() is None
+
+
+needs_git = pytest.mark.skipif(shutil.which("git") is None, reason="requires git")
+
+
+@needs_git
+@pytest.mark.parametrize("version", [2, 3, 4])
+def test_index__staged_files__blobs_match_git(tmp_path, version):
+    (tmp_path / "one.py").write_text("one = 1")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "two.py").write_text("two = 2")
+    git_add(tmp_path, "one.py", "sub/two.py", index_version=version)
+    if version == 3:
+        subprocess.run(
+            ["git", "update-index", "--skip-worktree", "one.py"],
+            cwd=tmp_path,
+            check=True,
+        )
+
+    index = Repo(tmp_path / ".git").get_index()
+    assert sorted(index.entries) == ["one.py", "sub/two.py"]
+
+    expected = subprocess.run(
+        ["git", "hash-object", "sub/two.py"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    assert index.get_clean_blob("sub/two.py", tmp_path / "sub" / "two.py") == expected
+
+
+@needs_git
+def test_index__file_modified__not_clean(tmp_path):
+    path = tmp_path / "one.py"
+    path.write_text("one = 1")
+    git_add(tmp_path, "one.py")
+
+    path.write_text("one = 11")
+    index = Repo(tmp_path / ".git").get_index()
+    assert index.get_clean_blob("one.py", path) is None
+
+
+def test_index__does_not_exist__returns_none(paths):
+    assert Repo(paths.git).get_index() is None
+
+
+@needs_git
+def test_changed_paths__modified_and_staged__found(tmp_path):
+    for name in ["one.py", "two.py", "three.py"]:
+        (tmp_path / name).write_text("value = 1")
+    commit = git_commit(tmp_path, "one.py", "two.py", "three.py")
+    repo = Repo(tmp_path / ".git")
+    assert repo.get_head_commit() == commit
+    assert repo.get_changed_paths(commit) == set()
+
+    (tmp_path / "one.py").write_text("value = 2")
+    (tmp_path / "two.py").unlink()
+    (tmp_path / "four.py").write_text("value = 1")
+    git_add(tmp_path, "four.py")
+    assert repo.get_changed_paths(commit) == {"one.py", "two.py", "four.py"}
+
+
+@needs_git
+def test_changed_paths__unknown_commit__returns_none(tmp_path):
+    (tmp_path / "one.py").write_text("value = 1")
+    git_commit(tmp_path, "one.py")
+    assert Repo(tmp_path / ".git").get_changed_paths("0" * 40) is None
+
+
+def test_ref_store__packed_and_loose__loose_preferred(paths):
+    paths.packed_refs.write_text(
+        """# pack-refs with: peeled fully-peeled sorted
+11111 refs/heads/master
+22222 refs/remotes/origin/master
+^33333
+22222 refs/tags/0.0.1
+"""
+    )
+    (paths.git / "refs" / "heads").mkdir(parents=True)
+    (paths.git / "refs" / "heads" / "master").write_text("44444\n")
+    (paths.git / "refs" / "remotes" / "origin").mkdir(parents=True)
+    (paths.git / "refs" / "remotes" / "origin" / "HEAD").write_text(
+        "ref: refs/remotes/origin/master\n"
+    )
+
+    refs = RefStore(paths.git)
+    assert refs.get("refs/heads/master") == "44444"
+    assert refs.get("refs/remotes/origin/HEAD") == "22222"
+    assert refs.get("refs/heads/missing") is None
+    assert refs.get_names("22222") == ["refs/remotes/origin/master", "refs/tags/0.0.1"]
+    assert refs.get_names("11111") == []
+
+
+def test_ref_store__loose_ref_removed__not_resolved(paths):
+    paths.packed_refs.write_text("11111 refs/heads/master\n")
+    heads = paths.git / "refs" / "heads"
+    heads.mkdir(parents=True)
+    (heads / "master").write_text("22222\n")
+    (heads / "gone").write_text("33333\n")
+
+    refs = RefStore(paths.git)
+    assert refs.get("refs/heads/master") == "22222"
+    assert refs.get("refs/heads/gone") == "33333"
+
+    (heads / "master").unlink()
+    (heads / "gone").unlink()
+    assert refs.get("refs/heads/master") == "11111"
+    assert refs.get("refs/heads/gone") is None
+
+
+def test_ref_store__symbolic_ref_made_direct__not_followed(paths):
+    heads = paths.git / "refs" / "heads"
+    heads.mkdir(parents=True)
+    (heads / "master").write_text("11111\n")
+    (heads / "alias").write_text("ref: refs/heads/master\n")
+
+    refs = RefStore(paths.git)
+    assert refs.get("refs/heads/alias") == "11111"
+
+    (heads / "alias").write_text("22222\n")
+    assert refs.get("refs/heads/alias") == "22222"
+
+
+def test_ref_store__loose_remote_refs_fetched__names_found(paths):
+    remote = paths.git / "refs" / "remotes" / "origin"
+    remote.mkdir(parents=True)
+    (remote / "master").write_text("11111\n")
+    (remote / "develop").write_text("22222\n")
+    refs = RefStore(paths.git)
+    assert refs.get_names("22222") == ["refs/remotes/origin/develop"]
+
+    # Fetch moves develop and adds a new branch, without touching packed-refs
+    (remote / "develop").write_text("33333\n")
+    (remote / "feature").write_text("22222\n")
+    assert refs.get_names("33333") == ["refs/remotes/origin/develop"]
+    assert refs.get_names("22222") == ["refs/remotes/origin/feature"]
+
+
+def test_head_detached__remote_ref_fetched__returns_new_branch(paths):
+    paths.config.write_text(GIT_CONFIG)
+    remote = paths.git / "refs" / "remotes" / "origin"
+    remote.mkdir(parents=True)
+    (remote / "master").write_text("11111\n")
+    paths.head.write_text("11111\n")
+    assert Repo(paths.git).get_local_branch() == "master"
+
+    (remote / "develop").write_text("22222\n")
+    paths.head.write_text("22222\n")
+    assert Repo(paths.git).get_local_branch() == "develop"
+
+
+def test_ref_store__cached__read_again_when_packed_refs_changes(paths):
+    paths.packed_refs.write_text("11111 refs/remotes/origin/master\n")
+    refs = get_ref_store(paths.git)
+    assert get_ref_store(paths.git) is refs
+    assert Repo(paths.git).refs is refs
+
+    paths.packed_refs.write_text("22222 refs/remotes/origin/develop\n")
+    refs = get_ref_store(paths.git)
+    assert refs.get_names("22222") == ["refs/remotes/origin/develop"]
+
+
+def test_gitdir_file__submodule__repo_found(paths, tmp_path):
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    (sub / ".git").write_text("gitdir: ../.git\n")
+    paths.config.write_text(GIT_CONFIG)
+    paths.head.write_text("ref: refs/heads/master\n")
+
+    repo = Repo(sub / ".git")
+    assert repo.path == paths.git.resolve()
+    assert repo.work_tree == sub
+    assert repo.get_local_branch() == "master"
+    assert repo.get_remote_url() == "git@github.com:radiac/sphinx_gitref.git"
+
+
+def test_gitdir_file__invalid__fails_silently(tmp_path):
+    (tmp_path / ".git").write_text("not a pointer\n")
+    assert Repo(tmp_path / ".git").path is None
+
+
+@needs_git
+def test_worktree__head_and_config_found(tmp_path):
+    main = tmp_path / "main"
+    main.mkdir()
+    (main / "one.py").write_text("value = 1")
+    commit = git_commit(main, "one.py")
+    (main / ".git" / "config").write_text(
+        (main / ".git" / "config").read_text()
+        + '[remote "origin"]\n\turl = git@github.com:radiac/sphinx_gitref.git\n'
+    )
+    subprocess.run(
+        ["git", "worktree", "add", "-q", "-b", "feature", str(tmp_path / "wt")],
+        cwd=main,
+        check=True,
+        capture_output=True,
+    )
+
+    repo = Repo(tmp_path / "wt" / ".git")
+    assert repo.common_path == (main / ".git").resolve()
+    assert repo.get_local_branch() == "feature"
+    assert repo.get_head_commit() == commit
+    assert repo.get_remote_url() == "git@github.com:radiac/sphinx_gitref.git"
+    assert repo.get_index().entries.keys() == {"one.py"}
+
+    (tmp_path / "wt" / "one.py").write_text("value = 2")
+    assert repo.get_changed_paths(commit) == {"one.py"}
@@ -0,0 +1,497 @@
+"""
+Test sphinx_gitref.hasher
+"""
+import gc
+import json
+import shutil
+
+import pytest
+
+from sphinx_gitref.git import Repo
+from sphinx_gitref.hasher import (
+    Hasher,
+    hash_file,
+    hash_file_text,
+    hash_node,
+    hash_node_source,
+    hash_node_structure,
+    walk_dir,
+)
+from sphinx_gitref.parser import ParsedModule
+
+from .common import backdate, git_add, git_commit
+
+
+EXAMPLE = """value = 1
+
+@decorator
+class Cls:
+    # comment
+    value = 1
+
+    def function(self):
+        return "é"
+"""
+
+
+needs_git = pytest.mark.skipif(shutil.which("git") is None, reason="requires git")
+
+
+@pytest.fixture
+def paths(tmp_path):
+    class paths:
+        root = tmp_path
+        hashfile = tmp_path / "gitref.json"
+        example = tmp_path / "example.py"
+
+    paths.example.write_text(EXAMPLE)
+    return paths
+
+
+def make_hasher(paths, updating, **kwargs):
+    return Hasher(
+        file=paths.hashfile,
+        project_root=paths.root,
+        hashing=True,
+        updating=updating,
+        **kwargs,
+    )
+
+
+def test_hash_node_source__hashes_original_source():
+    parsed = ParsedModule(EXAMPLE)
+    cls = parsed.lookup("Cls").node
+    method = parsed.lookup("Cls.function").node
+
+    assert parsed.segment(cls).startswith(b"@decorator\nclass Cls:\n    # comment")
+    assert parsed.segment(method).decode() == (
+        'def function(self):\n        return "é"'
+    )
+    assert hash_node_source(cls, parsed) != hash_node(cls)
+
+
+def test_update__source_mode__hash_mode_stored(paths):
+    hasher = make_hasher(paths, updating=True, hash_mode="source")
+    hasher.find_target("example.py::Cls")
+    hasher.build_file()
+
+    data = json.loads(paths.hashfile.read_text())
+    assert data["hash_mode"] == "source"
+    parsed = ParsedModule(EXAMPLE)
+    assert data["files"]["example.py"]["coderefs"]["Cls"][0] == hash_node_source(
+        parsed.lookup("Cls").node, parsed
+    )
+
+
+def test_check__file_without_hash_mode__checked_with_unparse(paths):
+    parsed = ParsedModule(EXAMPLE)
+    paths.hashfile.write_text(
+        json.dumps(
+            {
+                "version": 1,
+                "hashes": {"example.py::Cls": hash_node(parsed.lookup("Cls").node)},
+                "lines": {"example.py::Cls": 4},
+            }
+        )
+    )
+
+    hasher = make_hasher(paths, updating=False, hash_mode="source")
+    assert hasher.hash_mode == "unparse"
+    hasher.check()
+    assert hasher.errors == {}
+
+
+def test_check__source_mode__comment_change_detected(paths):
+    hasher = make_hasher(paths, updating=True, hash_mode="source")
+    hasher.find_target("example.py::Cls")
+    hasher.build_file()
+
+    paths.example.write_text(EXAMPLE.replace("# comment", "# changed"))
+    hasher = make_hasher(paths, updating=False)
+    assert hasher.hash_mode == "source"
+    hasher.check()
+    assert hasher.errors == {"example.py::Cls": "Target changed"}
+
+
+def test_hash_node_structure__formatting_ignored():
+    reformatted = EXAMPLE.replace("    # comment\n", "").replace(
+        "def function(self):", "def function(\n        self,\n    ):"
+    )
+    first = ParsedModule(EXAMPLE)
+    second = ParsedModule(reformatted)
+    assert hash_node_structure(
+        first.lookup("Cls").node, first.fingerprints
+    ) == hash_node_structure(second.lookup("Cls").node, second.fingerprints)
+
+
+def test_hash_node_structure__code_changed__hash_changed():
+    first = ParsedModule(EXAMPLE)
+    second = ParsedModule(
+        EXAMPLE.replace("value = 1\n\n    def", "value = 2\n\n    def")
+    )
+    assert hash_node_structure(
+        first.lookup("Cls").node, first.fingerprints
+    ) != hash_node_structure(second.lookup("Cls").node, second.fingerprints)
+
+
+def test_hash_node_structure__nested_coderefs__methods_hashed_once():
+    parsed = ParsedModule(EXAMPLE)
+    cls = parsed.lookup("Cls").node
+    expected = hash_node_structure(cls, {})
+
+    # Replace the method's digest - if it's reused, the class hash will change
+    method = parsed.lookup("Cls.function").node
+    hash_node_structure(method, parsed.fingerprints)
+    parsed.fingerprints[id(method)] = (method, b"0" * 32)
+    assert hash_node_structure(cls, parsed.fingerprints) != expected
+
+
+def test_hash_node_structure__memo__keeps_nodes_alive():
+    memo = {}
+    hash_node_structure(ParsedModule(EXAMPLE).lookup("Cls").node, memo)
+    gc.collect()
+
+    # The nodes are still referenced, so their ids can't be reused by other nodes
+    assert all(id(node) == node_id for node_id, (node, _) in memo.items())
+
+    parsed = ParsedModule(
+        EXAMPLE.replace("value = 1\n\n    def", "value = 2\n\n    def")
+    )
+    cls = parsed.lookup("Cls").node
+    assert hash_node_structure(cls, memo) == hash_node_structure(cls, {})
+
+
+@pytest.mark.parametrize("threshold", [0, 1024])
+def test_hash_file__streamed_or_read__same_hash(paths, threshold):
+    assert hash_file(paths.example, stream_threshold=threshold) == hash_file_text(
+        paths.example
+    )
+
+
+def test_check__whole_file_with_text_hash__accepted(paths):
+    paths.example.write_bytes(EXAMPLE.replace("\n", "\r\n").encode("utf-8"))
+    paths.hashfile.write_text(
+        json.dumps(
+            {
+                "version": 1,
+                "hashes": {"example.py": hash_file_text(paths.example)},
+                "lines": {},
+            }
+        )
+    )
+    assert hash_file(paths.example) != hash_file_text(paths.example)
+
+    hasher = make_hasher(paths, updating=False)
+    hasher.check()
+    assert hasher.errors == {}
+
+
+def test_update__binary_file__hashed(paths):
+    binary = paths.root / "data.bin"
+    binary.write_bytes(bytes(range(256)))
+    hasher = make_hasher(paths, updating=True)
+    hasher.find_target("data.bin")
+    assert hasher.errors == {}
+    assert "data.bin" in hasher.hashes
+
+
+@pytest.fixture
+def package(paths):
+    package = paths.root / "package"
+    (package / "sub").mkdir(parents=True)
+    (package / "__pycache__").mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "sub" / "module.py").write_text("a = 1")
+    (package / "__pycache__" / "module.cpython-311.pyc").write_bytes(b"\0")
+    return package
+
+
+def test_walk_dir__ignored_paths_skipped(package):
+    assert [rel for rel, path in walk_dir(package, ["__pycache__"])] == [
+        "__init__.py",
+        "sub/module.py",
+    ]
+
+
+def test_update_check__directory__hashed(paths, package):
+    hasher = make_hasher(paths, updating=True)
+    hasher.find_target("package")
+    hasher.build_file()
+    assert hasher.errors == {}
+
+    # Ignored files don't affect the hash
+    (package / "__pycache__" / "module.cpython-311.pyc").write_bytes(b"\1")
+    hasher = make_hasher(paths, updating=False)
+    hasher.check()
+    assert hasher.errors == {}
+
+    (package / "sub" / "module.py").write_text("a = 2")
+    hasher = make_hasher(paths, updating=False)
+    hasher.check()
+    assert hasher.errors == {"package": "Target changed"}
+
+
+def test_check__directory_unchanged__files_not_read(paths, package, monkeypatch):
+    cache_file = paths.root / "gitref.cache.json"
+    backdate(*package.rglob("*"))
+    hasher = make_hasher(paths, updating=True, cache_file=cache_file)
+    hasher.find_target("package")
+    hasher.build_file()
+    hasher.symbols.save()
+
+    read = []
+    hasher = make_hasher(paths, updating=False, cache_file=cache_file)
+    monkeypatch.setattr(hasher.symbols, "digest_file", read.append)
+    hasher.check()
+    assert hasher.errors == {}
+    assert read == []
+
+
+@needs_git
+def test_check__git_index_clean__file_not_read(paths, monkeypatch):
+    git_add(paths.root, "example.py")
+    repo = Repo(paths.root / ".git")
+    hasher = make_hasher(paths, updating=True, repo=repo, use_git_index=True)
+    hasher.find_target("example.py")
+    hasher.build_file()
+    assert hasher.blobs["example.py"]
+
+    read = []
+    hasher = make_hasher(paths, updating=False, repo=repo, use_git_index=True)
+    monkeypatch.setattr(hasher.symbols, "digest_file", read.append)
+    hasher.check()
+    assert hasher.errors == {}
+    assert read == []
+
+
+@needs_git
+def test_check__git_index_dirty__file_read(paths):
+    git_add(paths.root, "example.py")
+    repo = Repo(paths.root / ".git")
+    hasher = make_hasher(paths, updating=True, repo=repo, use_git_index=True)
+    hasher.find_target("example.py")
+    hasher.build_file()
+
+    paths.example.write_text("changed = 1")
+    hasher = make_hasher(paths, updating=False, repo=repo, use_git_index=True)
+    hasher.check()
+    assert hasher.errors == {"example.py": "Target changed"}
+
+
+def test_check__stat_unchanged__file_not_read(paths, monkeypatch):
+    backdate(paths.example)
+    hasher = make_hasher(paths, updating=True)
+    hasher.find_target("example.py")
+    hasher.find_target("example.py::Cls.function")
+    hasher.build_file()
+    assert "stat" in json.loads(paths.hashfile.read_text())["files"]["example.py"]
+
+    hasher = make_hasher(paths, updating=False)
+    monkeypatch.setattr(hasher.symbols, "digest_file", None)
+    monkeypatch.setattr(hasher.modules, "get", None)
+    hasher.check()
+    assert hasher.errors == {}
+    assert hasher.lines["example.py::Cls.function"] == 8
+
+
+def test_check__stat_unchanged_but_paranoid__file_hashed(paths):
+    backdate(paths.example)
+    hasher = make_hasher(paths, updating=True)
+    hasher.find_target("example.py::Cls")
+    hasher.build_file()
+
+    hasher = make_hasher(paths, updating=False, paranoid=True)
+    hasher.check()
+    assert hasher.errors == {}
+    assert hasher.modules.misses == 1
+
+
+def test_update__file_recently_modified__stat_not_stored(paths):
+    hasher = make_hasher(paths, updating=True)
+    hasher.find_target("example.py")
+    assert hasher.stats == {}
+
+
+def test_check__parallel__same_results_as_serial(paths, monkeypatch):
+    for i in range(4):
+        (paths.root / f"module{i}.py").write_text(EXAMPLE)
+
+    targets = [
+        f"module{i}.py{ref}" for i in range(4) for ref in ["", "::Cls", "::value"]
+    ]
+    hasher = make_hasher(paths, updating=True)
+    for target in targets:
+        hasher.find_target(target)
+    hasher.build_file()
+
+    (paths.root / "module1.py").write_text(EXAMPLE.replace("value = 1", "value = 2"))
+    (paths.root / "module2.py").unlink()
+
+    serial = make_hasher(paths, updating=False, workers=1)
+    serial.check()
+
+    monkeypatch.setattr("sphinx_gitref.hasher.PARALLEL_CHECK_THRESHOLD", 1)
+    parallel = make_hasher(paths, updating=False, workers=2)
+    parallel.check()
+
+    assert parallel.errors == serial.errors
+    assert parallel.lines == serial.lines
+    assert "module1.py::Cls" in parallel.errors
+    assert parallel.errors["module2.py"] == "File not found"
+
+
+def test_find_target__repeated__resolved_once(paths, monkeypatch):
+    hasher = make_hasher(paths, updating=True)
+    assert hasher.find_target("example.py::Cls") is True
+
+    monkeypatch.setattr(hasher, "resolve_target", None)
+    assert hasher.find_target("example.py::Cls") is True
+    assert hasher.find_target("example.py::Cls", checking=True) is True
+    assert hasher.used == {"example.py::Cls"}
+
+
+def test_find_target__checked__not_resolved_again(paths, monkeypatch):
+    hasher = make_hasher(paths, updating=True)
+    hasher.find_target("example.py::missing")
+    hasher.find_target("example.py")
+    hasher.build_file()
+
+    hasher = make_hasher(paths, updating=False)
+    hasher.check()
+    monkeypatch.setattr(hasher, "resolve_target", None)
+    assert hasher.find_target("example.py") is True
+    assert hasher.used == {"example.py"}
+
+
+def test_find_targets__interleaved_files__each_parsed_once(paths):
+    other = paths.root / "other.py"
+    other.write_text(EXAMPLE)
+    hasher = make_hasher(paths, updating=True, module_cache_size=1)
+    hasher.find_targets(
+        ["example.py::value", "other.py::value", "example.py::Cls", "other.py::Cls"]
+    )
+
+    assert hasher.modules.misses == 2
+    assert hasher.lines == {
+        "example.py::value": 1,
+        "example.py::Cls": 4,
+        "other.py::value": 1,
+        "other.py::Cls": 4,
+    }
+
+
+def make_changed_repo(paths):
+    """
+    Commit example.py and other.py, leave untracked.py untracked
+    """
+    for name in ["other.py", "untracked.py"]:
+        (paths.root / name).write_text("value = 1")
+    commit = git_commit(paths.root, "example.py", "other.py")
+    return Repo(paths.root / ".git"), commit
+
+
+def resolve_with_changed_only(paths, repo, monkeypatch):
+    hasher = make_hasher(paths, updating=False, repo=repo, changed_only=True)
+    resolved = []
+    resolve_target = hasher.resolve_target
+
+    def record(target):
+        resolved.append(target)
+        return resolve_target(target)
+
+    monkeypatch.setattr(hasher, "resolve_target", record)
+    hasher.check()
+    return hasher, sorted(resolved)
+
+
+@needs_git
+def test_check__changed_only__unchanged_files_trusted(paths, monkeypatch):
+    repo, commit = make_changed_repo(paths)
+    targets = ["example.py::Cls", "other.py::value", "untracked.py::value"]
+    hasher = make_hasher(paths, updating=True, repo=repo)
+    hasher.find_targets(targets)
+    hasher.build_file()
+    data = json.loads(paths.hashfile.read_text())
+    assert data["commit"] == commit
+    assert data["dirty"] == []
+
+    (paths.root / "other.py").write_text("value = 2")
+    hasher, resolved = resolve_with_changed_only(paths, repo, monkeypatch)
+    assert resolved == ["other.py::value", "untracked.py::value"]
+    assert hasher.errors == {"other.py::value": "Target changed"}
+    assert hasher.find_target("example.py::Cls") is True
+
+
+@needs_git
+def test_check__changed_only__dirty_at_update__checked(paths, monkeypatch):
+    repo, commit = make_changed_repo(paths)
+    paths.example.write_text(EXAMPLE.replace("value = 1", "value = 2"))
+    hasher = make_hasher(paths, updating=True, repo=repo)
+    hasher.find_targets(["example.py::value", "other.py::value"])
+    hasher.build_file()
+    assert json.loads(paths.hashfile.read_text())["dirty"] == ["example.py"]
+
+    # Reverting to the commit takes it out of the diff, but it no longer matches
+    paths.example.write_text(EXAMPLE)
+    hasher, resolved = resolve_with_changed_only(paths, repo, monkeypatch)
+    assert resolved == ["example.py::value"]
+    assert hasher.errors == {"example.py::value": "Target changed"}
+
+
+def test_check__changed_only_without_commit__all_checked(paths, monkeypatch):
+    hasher = make_hasher(paths, updating=True)
+    hasher.find_targets(["example.py::value", "example.py::Cls"])
+    hasher.build_file()
+
+    hasher, resolved = resolve_with_changed_only(paths, None, monkeypatch)
+    assert resolved == ["example.py::Cls", "example.py::value"]
+
+
+def test_build_file__version_1__migrated(paths):
+    parsed = ParsedModule(EXAMPLE)
+    paths.hashfile.write_text(
+        json.dumps(
+            {
+                "version": 1,
+                "hashes": {
+                    "example.py": hash_file(paths.example),
+                    "example.py::Cls": hash_node(parsed.lookup("Cls").node),
+                },
+                "lines": {"example.py::Cls": 4},
+                "blobs": {"example.py": "abc123"},
+            }
+        )
+    )
+    hasher = make_hasher(paths, updating=False)
+    hasher.build_file()
+
+    data = json.loads(paths.hashfile.read_text())
+    assert data["version"] == 2
+    assert data["files"] == {
+        "example.py": {
+            "hash": hash_file(paths.example),
+            "blob": "abc123",
+            "coderefs": {"Cls": [hash_node(parsed.lookup("Cls").node), 4]},
+        },
+    }
+
+    hasher = make_hasher(paths, updating=False)
+    hasher.check()
+    assert hasher.errors == {}
+    assert hasher.lines == {"example.py::Cls": 4}
+
+
+def test_check__file_digest_unchanged__coderefs_not_parsed(paths, monkeypatch):
+    hasher = make_hasher(paths, updating=True)
+    hasher.find_targets(["example.py::value", "example.py::Cls.function"])
+    hasher.build_file()
+    data = json.loads(paths.hashfile.read_text())
+    assert data["files"]["example.py"]["digest"] == hash_file(paths.example)
+
+    # Rewrite the file so its stat signature changes but its contents don't
+    paths.example.write_text(EXAMPLE)
+    hasher = make_hasher(paths, updating=False)
+    monkeypatch.setattr(hasher.modules, "get", None)
+    hasher.check()
+    assert hasher.errors == {}
+    assert hasher.lines["example.py::Cls.function"] == 8
@@ -1,10 +1,18 @@
 """
 Test sphinx_gitref.parser
 """
+import ast
+
 import pytest
 
-from sphinx_gitref.exceptions import ParseError
-from sphinx_gitref.parser import python_string_to_node
+from sphinx_gitref.exceptions import NodeNotFound, ParseError
+from sphinx_gitref.parser import (
+    ModuleCache,
+    ParsedModule,
+    SymbolIndex,
+    python_string_to_node,
+    python_to_node,
+)
 
 
 def test_string__var_exists__returns_lineno():
@@ -117,3 +125,163 @@ class Foo:
             """,
             "bar",
         )
+
+
+def test_cache__same_file__parsed_once(tmp_path):
+    path = tmp_path / "example.py"
+    path.write_text("a = 1\nb = 2\n")
+    cache = ModuleCache()
+
+    assert python_to_node(path, "a", cache=cache).lineno == 1
+    assert python_to_node(path, "b", cache=cache).lineno == 2
+    assert cache.misses == 1
+    assert cache.hits == 1
+
+
+def test_cache__file_changed__parsed_again(tmp_path):
+    path = tmp_path / "example.py"
+    path.write_text("a = 1\n")
+    cache = ModuleCache()
+    python_to_node(path, "a", cache=cache)
+
+    path.write_text("b = 1\na = 2\n")
+    assert python_to_node(path, "a", cache=cache).lineno == 2
+    assert cache.misses == 2
+
+
+def test_cache__over_maxsize__least_recently_used_evicted(tmp_path):
+    paths = [tmp_path / f"example{i}.py" for i in range(3)]
+    for path in paths:
+        path.write_text("a = 1\n")
+    cache = ModuleCache(maxsize=2)
+
+    cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])
+    cache.get(paths[2])
+    assert list(cache.entries) == [paths[0], paths[2]]
+
+
+def test_cache__syntax_error__raises_error_each_time(tmp_path):
+    path = tmp_path / "example.py"
+    path.write_text("a = \n")
+    cache = ModuleCache()
+
+    for _ in range(2):
+        with pytest.raises(ParseError):
+            python_to_node(path, "a", cache=cache)
+    assert cache.misses == 1
+
+
+def test_index__nested_names__indexed():
+    module = ast.parse(
+        """
+a = 1
+b: int = 2
+
+class Foo:
+    bar = 1
+
+    def baz(self):
+        pass
+"""
+    )
+    index = SymbolIndex(module.body)
+    assert sorted(index.symbols) == ["Foo", "Foo.bar", "Foo.baz", "a", "b"]
+    assert index.lookup("Foo.baz").lineno == 8
+    assert index.lookup("Foo.baz").end_lineno == 9
+
+
+def test_index__name_defined_twice__first_definition_wins():
+    module = ast.parse(
+        """
+class Foo:
+    pass
+
+class Foo:
+    bar = 1
+"""
+    )
+    index = SymbolIndex(module.body)
+    assert index.lookup("Foo").lineno == 2
+    assert "Foo.bar" not in index
+
+
+def test_index__path_into_assignment__raises_error():
+    index = SymbolIndex(ast.parse("a = 1").body)
+    with pytest.raises(NodeNotFound) as e:
+        index.lookup("a.b")
+    assert str(e.value) == 'Found "a" but cannot go further'
+
+
+def test_index__missing_parent__raises_error():
+    index = SymbolIndex(ast.parse("a = 1").body)
+    with pytest.raises(NodeNotFound) as e:
+        index.lookup("Foo.bar")
+    assert str(e.value) == 'Couldn\'t find "Foo"'
+
+
+EXAMPLE_MODULE = '''"""
+Module docstring
+"""
+import os
+
+a = b = 1
+c: int = 2
+d = lambda x=1: x
+
+
+@decorator
+class Foo:
+    """
+def fake():
+    pass
+"""
+
+    bar = 1
+
+    def baz(self):
+        pass
+
+
+def foo():
+    pass
+
+
+e = 1; f = 2
+'''
+
+
+@pytest.mark.parametrize(
+    "ref", ["a", "b", "c", "d", "Foo", "Foo.bar", "Foo.baz", "foo", "e", "f"]
+)
+def test_lazy__ref_exists__matches_full_parse(ref):
+    full = python_string_to_node(EXAMPLE_MODULE, ref)
+    lazy = python_string_to_node(EXAMPLE_MODULE, ref, lazy=True)
+    assert (lazy.lineno, lazy.end_lineno) == (full.lineno, full.end_lineno)
+    assert ast.dump(lazy) == ast.dump(full)
+
+
+def test_lazy__decorated_class__lineno_matches_definition():
+    assert python_string_to_node(EXAMPLE_MODULE, "Foo", lazy=True).lineno == 12
+
+
+@pytest.mark.parametrize("ref", ["fake", "os", "Foo.missing", "a.b"])
+def test_lazy__ref_does_not_exist__raises_same_error(ref):
+    with pytest.raises(ParseError) as full:
+        python_string_to_node(EXAMPLE_MODULE, ref)
+    with pytest.raises(ParseError) as lazy:
+        python_string_to_node(EXAMPLE_MODULE, ref, lazy=True)
+    assert str(lazy.value) == str(full.value)
+
+
+def test_lazy__early_ref__rest_of_file_not_tokenized():
+    parsed = ParsedModule(EXAMPLE_MODULE, lazy=True)
+    parsed.lookup("a")
+    assert "foo" not in parsed._locator.blocks
+    assert parsed._module is None
+
+
+def test_lazy__invalid_source__falls_back_to_full_parse():
+    with pytest.raises(ParseError):
+        python_string_to_node("a = (\n", "a", lazy=True)
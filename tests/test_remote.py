@@ -6,7 +6,28 @@ import re
 
 import pytest
 
-from sphinx_gitref.remote import Bitbucket, GitHub, GitLab, Remote, registry
+from sphinx_gitref.remote import (
+    Bitbucket,
+    Gitea,
+    GitHub,
+    GitLab,
+    Registry,
+    Remote,
+    Template,
+    registry,
+)
+
+
+@pytest.fixture
+def isolated_registry(monkeypatch):
+    """
+    Replace the shared registry with a copy, so remotes defined in a test are discarded
+    """
+    isolated = Registry()
+    for remote in registry.remotes:
+        isolated.register(remote)
+    monkeypatch.setattr("sphinx_gitref.remote.registry", isolated)
+    return isolated
 
 
 def test_registry_get_by_url__github_ssh__detected():
@@ -112,12 +133,83 @@ def test_registry_get_by_url__unknown__raises_error():
     assert str(e.value) == f"Unable to find a match for {invalid}"
 
 
-def test_custom_remote__get_by_url__finds():
+def test_custom_remote__get_by_url__finds(isolated_registry):
     class TestRemote(Remote):
         remote_match = re.compile(r"^https://test.example.com/(?P<repo>.+?).git$")
 
     url = "https://test.example.com/user/repo.git"
-    remote = registry.get_by_url(url, "branch")
+    remote = isolated_registry.get_by_url(url, "branch")
     assert isinstance(remote, TestRemote)
     assert remote.repo == "user/repo"
     assert remote.branch == "branch"
+
+
+def test_custom_remote__subclass_of_builtin__matched_by_regex(isolated_registry):
+    class Enterprise(GitHub):
+        remote_match = re.compile(r"^git@ghe.corp:(?P<repo>.+?)\.git$")
+        url_pattern = "https://ghe.corp/{repo}/blob/{branch}/{filename}{line}"
+
+    remote = isolated_registry.get_by_url("git@ghe.corp:user/repo.git", "branch")
+    assert isinstance(remote, Enterprise)
+    assert remote.get_url("filename.py") == (
+        "https://ghe.corp/user/repo/blob/branch/filename.py"
+    )
+
+    # It doesn't take over the host of the remote it extends
+    remote = isolated_registry.get_by_url("git@github.com:user/repo.git", "branch")
+    assert type(remote) is GitHub
+
+
+def test_registry_get_by_url__ssh_url_with_port__detected():
+    url = "ssh://git@github.com:22/user/repo.git"
+    remote = registry.get_by_url(url, "branch")
+    assert isinstance(remote, GitHub)
+    assert remote.repo == "user/repo"
+
+
+def test_registry_get_by_url__self_hosted__uses_host():
+    url = "git@git.example.com:group/repo.git"
+    remote = registry.get_by_url(url, "branch", hosts={"git.example.com": "gitlab"})
+    assert isinstance(remote, GitLab)
+    assert remote.host == "git.example.com"
+    assert (
+        remote.get_url("filename.py", 20)
+        == "https://git.example.com/group/repo/blob/branch/filename.py#L20"
+    )
+
+    # The host is only used for that lookup
+    with pytest.raises(ValueError):
+        registry.get_by_url(url, "branch")
+
+
+def test_registry_get_by_url__self_hosted_unknown_name__raises_error():
+    with pytest.raises(ValueError) as e:
+        registry.get_by_url(
+            "git@github.com:user/repo.git",
+            "branch",
+            hosts={"git.example.com": "missing"},
+        )
+    assert str(e.value) == "Unknown remote missing"
+
+
+def test_gitea_url__url_with_line__correct_url():
+    remote = Gitea("user/repo", "branch", host="gitea.example.com")
+    assert (
+        remote.get_url("filename.py", 20)
+        == "https://gitea.example.com/user/repo/src/branch/filename.py#L20"
+    )
+
+
+def test_get_url__same_file_and_line__cached():
+    remote = GitHub("user/repo", "branch")
+    assert remote.get_url("filename.py", 20) is remote.get_url("filename.py", 20)
+    assert remote.urls.keys() == {("filename.py", 20)}
+
+
+def test_template__fixed_values__substituted_once():
+    template = Template("{host}/{repo!r}/{filename}{line:>3}", host="h", repo="r")
+    assert template.parts == [
+        ("h/'r'/", "filename", None, ""),
+        ("", "line", None, ">3"),
+    ]
+    assert template.render(filename="f", line=1) == "h/'r'/f  1"
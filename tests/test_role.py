@@ -7,7 +7,11 @@ import pytest
 from sphinx.application import Sphinx
 from sphinx.errors import SphinxError
 
-from .common import GIT_CONFIG
+from sphinx_gitref.cache import get_stat_signature
+from sphinx_gitref.hasher import Hasher, hash_file
+from sphinx_gitref.remote import registry
+
+from .common import backdate
 
 try:
     # Python 2.7
@@ -16,48 +20,6 @@ except ImportError:
     from io import StringIO
 
 
-@pytest.fixture
-def paths(tmp_path):
-    class paths:
-        root = tmp_path
-
-        # Docs
-        docs = tmp_path / "docs"
-        build = tmp_path / "docs" / "_build"
-        html = tmp_path / "docs" / "_build" / "html"
-        doctrees = tmp_path / "docs" / "_build" / "doctrees"
-        conf = tmp_path / "docs" / "conf.py"
-
-        # Git
-        git = tmp_path / ".git"
-        git_config = tmp_path / ".git" / "config"
-        git_head = tmp_path / ".git" / "HEAD"
-
-        # Code
-        example = tmp_path / "example.py"
-
-    paths.docs.mkdir()
-    paths.build.mkdir()
-    paths.html.mkdir()
-    paths.doctrees.mkdir()
-    paths.conf.write_text(
-        """
-master_doc = 'index'
-extensions = ["sphinx_gitref"]
-gitref_hashing = False
-"""
-    )
-
-    paths.git.mkdir()
-    paths.git_config.write_text(GIT_CONFIG)
-    paths.git_head.write_text("ref: refs/heads/master\n")
-
-    # Give a sensible default for most tests
-    paths.example.write_text("value = 1")
-
-    return paths
-
-
 EXAMPLE_FUNCTION = """value = 1
 
 def function():
@@ -186,3 +148,268 @@ def test_coderef_var__does_not_exist__renders_as_link_but_raises_error(app, path
     assert (
         'Error resolving "example.py::missing": Couldn\'t find "missing"'
     ) in app._warning.getvalue().splitlines()[-1]
+
+
+def make_parallel_app(paths, parallel=2, **confoverrides):
+    os.chdir(paths.docs)
+    return Sphinx(
+        srcdir=str(paths.docs),
+        confdir=str(paths.docs),
+        outdir=str(paths.html),
+        doctreedir=str(paths.doctrees),
+        status=StringIO(),
+        warning=StringIO(),
+        buildername="html",
+        confoverrides=confoverrides,
+        parallel=parallel,
+    )
+
+
+def write_parallel_docs(paths, targets):
+    index = paths.docs / "index.rst"
+    index.write_text(
+        "Index\n=====\n\n.. toctree::\n\n"
+        + "".join(f"   doc{i}\n" for i in range(len(targets)))
+    )
+    for i, target in enumerate(targets):
+        (paths.docs / f"doc{i}.rst").write_text(
+            f"Doc {i}\n======\n\nfoo :gitref:`{target}`\n"
+        )
+
+
+def test_parallel__update__results_merged(paths):
+    paths.example.write_text(EXAMPLE_CLASS)
+    targets = ["example.py", "example.py::value", "example.py::Cls"] + [
+        "example.py::Cls.function"
+    ] * 5
+    write_parallel_docs(paths, targets)
+
+    app = make_parallel_app(paths, gitref_hashing=True, gitref_updating=True)
+    app.build()
+
+    hasher = Hasher(paths.docs / "gitref.json", paths.root, True, False)
+    assert sorted(hasher.hashes) == sorted(set(targets))
+    assert hasher.lines == {
+        "example.py::value": 1,
+        "example.py::Cls": 3,
+        "example.py::Cls.function": 6,
+    }
+
+
+def test_parallel__update__file_state_merged(paths):
+    paths.example.write_text(EXAMPLE_CLASS)
+    backdate(paths.example)
+    targets = ["example.py", "example.py::value"] + ["example.py::Cls"] * 5
+    write_parallel_docs(paths, targets)
+    make_parallel_app(paths, gitref_hashing=True, gitref_updating=True).build()
+
+    hasher = Hasher(paths.docs / "gitref.json", paths.root, True, False)
+    assert hasher.digests == {"example.py": hash_file(paths.example)}
+    assert hasher.stats == {"example.py": get_stat_signature(paths.example)}
+
+    # Change the file and update in parallel again
+    paths.example.write_text(EXAMPLE_FUNCTION)
+    backdate(paths.example)
+    make_parallel_app(paths, gitref_hashing=True, gitref_updating=True).build()
+
+    hasher = Hasher(paths.docs / "gitref.json", paths.root, True, False)
+    assert hasher.digests == {"example.py": hash_file(paths.example)}
+    assert hasher.stats == {"example.py": get_stat_signature(paths.example)}
+
+    # Reverting the file must not be trusted by a stale digest
+    paths.example.write_text(EXAMPLE_CLASS)
+    backdate(paths.example)
+    app = make_parallel_app(paths, parallel=0, gitref_hashing=True)
+    with pytest.raises(SphinxError):
+        app.build()
+    assert app.hasher.errors["example.py"] == "Target changed"
+
+
+def test_parallel__missing_coderef__build_fails(paths):
+    targets = ["example.py::value"] * 6 + ["example.py::missing"]
+    write_parallel_docs(paths, targets)
+
+    app = make_parallel_app(paths)
+    with pytest.raises(SphinxError):
+        app.build()
+    assert app.hasher.errors == {
+        "example.py::missing": 'Couldn\'t find "missing"',
+    }
+
+
+def test_deferred__path_renders_as_link(paths):
+    paths.example.write_text(EXAMPLE_FUNCTION)
+    write_parallel_docs(paths, ["example.py", "example.py::function"])
+    app = make_parallel_app(paths, parallel=0, gitref_deferred=True)
+    app.build()
+
+    html = (paths.html / "doc1.html").read_text()
+    assert (
+        '<p>foo <a class="reference external" '
+        'href="https://github.com/radiac/sphinx_gitref/blob/master/example.py#L3">'
+        "function</a></p>"
+    ) in html
+    entry = app.env.gitref_docs["doc1"]["example.py::function"]
+    hashed, line, error, *file_state = entry
+    assert (line, error) == (3, None)
+
+
+def test_deferred__does_not_exist__renders_but_raises_error(paths):
+    write_parallel_docs(paths, ["example.py::value", "example.py::missing"])
+    app = make_parallel_app(paths, parallel=0, gitref_deferred=True)
+    with pytest.raises(SphinxError):
+        app.build()
+
+    html = (paths.html / "doc1.html").read_text()
+    assert "<p>foo missing</p>" in html
+    assert (
+        'doc1.rst:4: ERROR: [gitref] Error resolving "example.py::missing":'
+        in app._warning.getvalue()
+    )
+
+
+def test_deferred__parallel_update__targets_resolved_in_batch(paths, monkeypatch):
+    paths.example.write_text(EXAMPLE_CLASS)
+    targets = ["example.py::value", "example.py::Cls"] * 3
+    write_parallel_docs(paths, targets)
+
+    app = make_parallel_app(
+        paths, gitref_hashing=True, gitref_updating=True, gitref_deferred=True
+    )
+    batches = []
+    find_targets = app.hasher.find_targets
+
+    def record(targets, checking=False):
+        targets = list(targets)
+        batches.append(sorted(targets))
+        find_targets(targets, checking)
+
+    monkeypatch.setattr(app.hasher, "find_targets", record)
+    app.build()
+
+    assert batches[0] == ["example.py::Cls", "example.py::value"]
+    hasher = Hasher(paths.docs / "gitref.json", paths.root, True, False)
+    assert hasher.lines == {"example.py::value": 1, "example.py::Cls": 3}
+
+
+def build_docs(paths, **confoverrides):
+    """
+    Run a build, and return the app and the names of the documents which were read
+    """
+    confoverrides.setdefault("gitref_hashing", True)
+    app = make_parallel_app(paths, parallel=0, **confoverrides)
+    read = []
+
+    def record(app, env, docnames):
+        read.extend(docnames)
+
+    app.connect("env-before-read-docs", record)
+    app.build()
+    return app, sorted(read)
+
+
+def update_docs(paths, **confoverrides):
+    """
+    Run an update, and return the names of the documents which were read
+    """
+    app, read = build_docs(paths, gitref_updating=True, **confoverrides)
+    return read, Hasher(paths.docs / "gitref.json", paths.root, True, False)
+
+
+def test_update__incremental__only_affected_docs_read(paths):
+    other = paths.root / "other.py"
+    other.write_text("value = 1")
+    write_parallel_docs(paths, ["example.py::value", "other.py::value"])
+    read, hasher = update_docs(paths)
+    assert read == ["doc0", "doc1", "index"]
+
+    other.write_text("\nvalue = 1")
+    read, hasher = update_docs(paths)
+    assert read == ["doc1"]
+    assert hasher.lines == {"example.py::value": 1, "other.py::value": 2}
+
+
+def test_update__target_removed__kept_unless_pruned(paths):
+    write_parallel_docs(paths, ["example.py::value", "example.py"])
+    update_docs(paths)
+
+    (paths.docs / "doc1.rst").write_text("Doc 1\n=====\n")
+    read, hasher = update_docs(paths)
+    assert read == ["doc1"]
+    assert sorted(hasher.hashes) == ["example.py", "example.py::value"]
+
+    read, hasher = update_docs(paths, gitref_prune=True)
+    assert read == []
+    assert sorted(hasher.hashes) == ["example.py::value"]
+
+
+def test_check__warm_environment__only_failed_docs_read(paths):
+    write_parallel_docs(paths, ["example.py::value", "example.py"])
+    update_docs(paths)
+
+    app, read = build_docs(paths)
+    assert read == []
+    assert app.hasher.used == {"example.py::value", "example.py"}
+
+    paths.example.write_text("value = 1\nother = 2")
+    app = make_parallel_app(paths, parallel=0, gitref_hashing=True)
+    with pytest.raises(SphinxError):
+        app.build()
+    warnings = app._warning.getvalue()
+    assert 'doc1.rst:2: ERROR: [gitref] Error resolving "example.py"' in warnings
+    assert "doc0.rst" not in warnings
+
+
+def test_link_to_commit__links_use_head_sha(paths):
+    sha = "a" * 40
+    (paths.git / "refs" / "heads").mkdir(parents=True)
+    (paths.git / "refs" / "heads" / "master").write_text(f"{sha}\n")
+    paths.example.write_text(EXAMPLE_FUNCTION)
+    write_parallel_docs(paths, ["example.py::function"])
+    app = make_parallel_app(paths, parallel=0, gitref_link_to_commit=True)
+    app.build()
+
+    html = (paths.html / "doc0.html").read_text()
+    assert (
+        'href="https://github.com/radiac/sphinx_gitref/blob/'
+        f'{sha}/example.py#L3"'
+    ) in html
+
+
+def test_link_to_commit__new_commit__linked_docs_read(paths):
+    head = paths.git / "refs" / "heads" / "master"
+    head.parent.mkdir(parents=True)
+    head.write_text("a" * 40)
+    write_parallel_docs(paths, ["example.py::value"])
+    (paths.docs / "plain.rst").write_text(":orphan:\n\nPlain\n=====\n")
+    app, read = build_docs(paths, gitref_hashing=False, gitref_link_to_commit=True)
+    assert read == ["doc0", "index", "plain"]
+
+    app, read = build_docs(paths, gitref_hashing=False, gitref_link_to_commit=True)
+    assert read == []
+
+    head.write_text("b" * 40)
+    app, read = build_docs(paths, gitref_hashing=False, gitref_link_to_commit=True)
+    assert read == ["doc0"]
+    assert "b" * 40 in (paths.html / "doc0.html").read_text()
+
+
+def test_link_to_commit__no_commit__raises_error(paths):
+    write_parallel_docs(paths, ["example.py"])
+    with pytest.raises(SphinxError, match="gitref_link_to_commit"):
+        make_parallel_app(paths, parallel=0, gitref_link_to_commit=True)
+
+
+def test_remotes__self_hosted__links_to_host(paths):
+    write_parallel_docs(paths, ["example.py"])
+    app = make_parallel_app(
+        paths,
+        parallel=0,
+        gitref_remote_url="git@code.example.com:group/repo.git",
+        gitref_remotes={"code.example.com": "github"},
+    )
+    app.build()
+
+    html = (paths.html / "doc0.html").read_text()
+    assert 'href="https://code.example.com/group/repo/blob/master/example.py"' in html
+    assert "code.example.com" not in registry.hosts
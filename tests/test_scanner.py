@@ -0,0 +1,70 @@
+"""
+Test sphinx_gitref.scanner
+"""
+from sphinx_gitref.scanner import scan_myst, scan_rst
+
+
+RST = """Title
+=====
+
+See :gitref:`example.py` and :gitref:`Label <example.py::Cls>` and
+``:gitref:`literal.py``` and :gitref:`a long
+label <wrapped.py>`.
+
+Example::
+
+    :gitref:`literal_block.py`
+
+.. note::
+
+   Inside :gitref:`note.py`
+
+..
+   :gitref:`comment.py`
+
+.. code-block:: rst
+
+   :gitref:`code.py`
+
+.. _target:
+
+After :gitref:`escaped\\_name.py`
+"""
+
+MYST = """# Title
+
+See {gitref}`example.py` and {gitref}`Label <example.py::Cls>`.
+
+```rst
+{gitref}`code.py`
+```
+
+````{note}
+Inside {gitref}`note.py`
+```python
+{gitref}`nested_code.py`
+```
+````
+
+% {gitref}`comment.py`
+After {gitref}`after.py`
+"""
+
+
+def test_scan_rst__roles_found_outside_literals():
+    assert list(scan_rst(RST.splitlines(True))) == [
+        (4, "example.py"),
+        (4, "example.py::Cls"),
+        (5, "wrapped.py"),
+        (14, "note.py"),
+        (25, "escaped_name.py"),
+    ]
+
+
+def test_scan_myst__roles_found_outside_code():
+    assert list(scan_myst(MYST.splitlines(True))) == [
+        (3, "example.py"),
+        (3, "example.py::Cls"),
+        (10, "note.py"),
+        (17, "after.py"),
+    ]
@@ -0,0 +1,97 @@
+"""
+Test sphinx_gitref.watcher
+"""
+import pytest
+from click.testing import CliRunner
+
+from sphinx_gitref.commands import cli
+from sphinx_gitref.scanner import Scanner
+from sphinx_gitref.watcher import Watcher
+
+from .test_role import EXAMPLE_FUNCTION
+
+
+@pytest.fixture
+def watcher(extra_paths):
+    extra_paths.example.write_text(EXAMPLE_FUNCTION)
+    extra_paths.index.write_text("foo :gitref:`example.py::function`\n")
+    (extra_paths.root / "other.py").write_text("value = 1\n")
+    (extra_paths.docs / "other.rst").write_text("Other\n=====\n")
+    return make_watcher(extra_paths)
+
+
+def make_watcher(project):
+    """
+    Update the hash file, and return a watcher which has run its first check
+    """
+    result = CliRunner().invoke(cli, ["update", str(project.docs)])
+    assert result.exit_code == 0
+
+    output = []
+    watcher = Watcher(Scanner(project.docs), echo=output.append)
+    watcher.report(watcher.scanner.check())
+    watcher.snapshot()
+    watcher.output = output
+    return watcher
+
+
+def test_poll__nothing_changed__not_checked(watcher):
+    assert watcher.output[-1].endswith("1 gitref reference checked, 0 failed")
+    assert watcher.poll() is None
+
+
+def test_poll__target_changed__only_that_file_checked(watcher, extra_paths):
+    resolved = []
+    hasher = watcher.scanner.hasher
+    resolve_target = hasher.resolve_target
+
+    def record(target):
+        resolved.append(target)
+        return resolve_target(target)
+
+    hasher.resolve_target = record
+    extra_paths.example.write_text(EXAMPLE_FUNCTION.replace("pass", "return 1"))
+    errors = watcher.poll()
+    assert resolved == ["example.py::function"]
+    assert len(errors) == 1
+    assert 'Error resolving "example.py::function": Target changed' in errors[0]
+
+    extra_paths.example.write_text(EXAMPLE_FUNCTION)
+    assert watcher.poll() == []
+
+
+def test_poll__doc_changed__new_reference_checked(watcher, extra_paths):
+    (extra_paths.docs / "other.rst").write_text("Other\n=====\n\n:gitref:`other.py`\n")
+    errors = watcher.poll()
+    assert errors == [
+        f'{extra_paths.docs / "other.rst"}:4: ERROR: [gitref] Error resolving'
+        ' "other.py": Unknown target'
+    ]
+    assert watcher.scanner.hasher.used == {"example.py::function", "other.py"}
+
+
+def test_poll__hash_file_updated__reloaded(watcher, extra_paths):
+    (extra_paths.docs / "other.rst").write_text("Other\n=====\n\n:gitref:`other.py`\n")
+    assert len(watcher.poll()) == 1
+
+    modules = watcher.scanner.hasher.modules
+    CliRunner().invoke(cli, ["update", str(extra_paths.docs)])
+    assert watcher.poll() == []
+    assert watcher.scanner.hasher.modules is modules
+
+
+def test_poll__file_in_dir_target_changed__checked(extra_paths):
+    package = extra_paths.root / "pkg"
+    package.mkdir()
+    (package / "a.py").write_text("value = 1\n")
+    extra_paths.index.write_text("foo :gitref:`pkg`\n")
+    watcher = make_watcher(extra_paths)
+    assert watcher.output[-1].endswith("1 gitref reference checked, 0 failed")
+
+    (package / "a.py").write_text("value = 2\n")
+    errors = watcher.poll()
+    assert len(errors) == 1
+    assert 'Error resolving "pkg": Target changed' in errors[0]
+
+    (package / "a.py").write_text("value = 1\n")
+    assert watcher.poll() == []